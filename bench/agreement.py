@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Checks that the results of midsin.Assay computed from its midsin.Layout,
+and those of midsin.AssayBatch, agree with those of midsin.Assay computed
+on its own adaptive grid (uselayout=False), on random plates of random
+layouts (limits of detection included), drawn from a fixed seed: to within
+1e-10 for mode, RM, SK and LOD, which do not depend on the grid, and to
+within the precision tier's error (see midsin.precisions) for the credible
+bounds and mean. The largest differences are printed, and the run fails if
+any exceeds its tolerance.
+"""
+
+import argparse
+import sys
+import warnings
+import numpy
+import midsin
+
+
+# Largest error on the credible bounds of each tier, as in midsin.precisions
+errors = {'fast': 5.0e-3, 'standard': 1.5e-4, 'high': 2.0e-6}
+
+
+def random_plates(nplates, rng):
+	for i in range(nplates):
+		ndils, nreps = rng.integers(3,13), rng.integers(1,13)
+		Vinoc, dilmin, dilfac = rng.choice([0.1,0.02]), rng.choice([1.0,0.1,0.01]), rng.choice([0.1,0.25,0.5])
+		VDs = Vinoc*dilmin*dilfac**numpy.arange(ndils)
+		lC = rng.uniform(-1.0,-ndils*numpy.log10(dilfac)+1.0) - numpy.log10(Vinoc*dilmin)
+		yield Vinoc, dilmin, dilfac, list(rng.binomial(nreps, -numpy.expm1(-10.0**lC*VDs))), [int(nreps)]*ndils
+
+
+def results(pack):
+	return numpy.array([pack['mode']] + list(pack['bounds']) + [pack['RM'], pack['SK'], pack['LOD'], pack['mean']], dtype=float)
+
+
+parser = argparse.ArgumentParser(description="Check that midsin.Layout and midsin.AssayBatch agree with midsin.Assay")
+parser.add_argument('-n','--nplates', type=int, default=300,
+	help='number of random plates (default: 300)')
+parser.add_argument('-p','--precision', choices=list(midsin.precisions), default='standard',
+	help='precision tier (default: standard)')
+parser.add_argument('--tol', type=float, default=None,
+	help='largest difference allowed on the credible bounds and mean (default: the error of the tier, %s)' % ', '.join('%g' % errors[key] for key in midsin.precisions))
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+if args.tol is None:
+	args.tol = errors[args.precision]
+
+# Columns of results(), and their tolerance
+columns = ['mode'] + midsin.outcols[1:5] + ['RM','SK','LOD','mean']
+tols = numpy.array([1.0e-10] + [args.tol]*4 + [1.0e-10]*3 + [args.tol])
+
+plates = list(random_plates(args.nplates, numpy.random.default_rng(args.seed)))
+with warnings.catch_warnings():
+	warnings.simplefilter('ignore', RuntimeWarning)
+	ref = numpy.array([results(midsin.Assay(*plate, precision=args.precision, usecache=False, uselayout=False).pack) for plate in plates])
+	layout = numpy.array([results(midsin.Assay(*plate, precision=args.precision, usecache=False).pack) for plate in plates])
+	batch = midsin.AssayBatch(*zip(*plates), precision=args.precision)
+batch = numpy.array([[batch.pack[key][i] for key in columns] for i in range(len(plates))])
+
+failed = False
+print('%-12s' % 'column' + ''.join('%14s' % name for name in ('tol','Layout','AssayBatch')))
+for j, name in enumerate(columns):
+	line = '%-12s%14.3g' % (name, tols[j])
+	for values in (layout, batch):
+		# nan (e.g. no mode at the limit of detection) must match nan
+		same = numpy.isnan(values[:,j]) == numpy.isnan(ref[:,j])
+		diff = numpy.nanmax(numpy.abs(values[:,j]-ref[:,j]), initial=0.0) if same.all() else numpy.inf
+		failed |= diff > tols[j]
+		line += '%14.3g' % diff
+	print(line)
+print('%d plates, %s' % (len(plates), 'FAILED' if failed else 'ok'))
+sys.exit(1 if failed else 0)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Calibrates midSIN on simulated plates of a fixed 96-well layout (11 10-fold
+dilutions x 8 repeats) with midsin.simulate.coverage: the coverage of its
+68% and 95% credible intervals, and the bias and rmse of the mode, mean, RM
+and SK, at each of a set of true log10(SIN/mL) values, along with the
+throughput in plates/second. The results are printed and, with -o, saved
+as JSON.
+"""
+
+import argparse
+import json
+import platform
+import time
+import numpy
+import midsin
+import midsin.simulate
+
+
+parser = argparse.ArgumentParser(description="Calibrate the credible intervals and estimates of midSIN on simulated 96-well plates")
+parser.add_argument('-n','--nplates', type=int, default=20000,
+	help='number of plates drawn at each true value (default: 20000)')
+parser.add_argument('--lc', type=float, nargs='+', default=[2.5,3.5,4.5,5.5,6.5,7.5,8.5,9.5,10.5],
+	help='true log10(SIN/mL) values (default: 2.5 to 10.5 by 1)')
+parser.add_argument('-p','--precision', type=str, default='standard', choices=list(midsin.precisions),
+	help='precision tier (default: standard)')
+parser.add_argument('-j','--jobs', type=int, default=1,
+	help='number of processes (default: 1)')
+parser.add_argument('-s','--seed', type=int, default=0,
+	help='seed of the simulated plates (default: 0)')
+parser.add_argument('-o','--output', type=str, default=None,
+	help='JSON file where the results are saved')
+args = parser.parse_args()
+
+tic = time.perf_counter()
+results = midsin.simulate.coverage(args.lc, nplates=args.nplates, precision=args.precision, jobs=args.jobs, seed=args.seed)
+seconds = time.perf_counter()-tic
+
+print(midsin.simulate.summary(results))
+print('%d plates in %.2f s, %.0f plates/s' % (args.nplates*len(args.lc), seconds, args.nplates*len(args.lc)/seconds))
+
+if args.output:
+	meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'numpy': numpy.__version__, 'nplates': args.nplates, 'precision': args.precision, 'jobs': args.jobs, 'seed': args.seed, 'seconds': seconds}
+	with open(args.output, 'w') as f:
+		json.dump({'meta': meta, 'results': results}, f, indent=1)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Compares the direct highest posterior density computation of the credible
+bounds (as used by Assay.lCbounds) against the former interp1d inverse-CDF
+plus bounded minimization, on the same lCvec/pdf grids of random plates:
+their speed, one assay at a time and for all assays at once, and their
+agreement, which fails the run if above --tol. Their difference is mostly
+the error of the former method, whose interval width is flat near its
+minimum, so that a small error on the CDF gives a much larger error on
+the bounds: the default tol is that error, as found for each precision
+tier against a 2e-5-spaced grid.
+"""
+
+import argparse
+import sys
+import time
+import numpy
+import scipy.interpolate
+import scipy.optimize
+import midsin
+
+
+def minimize_bounds(lCvec, cdf, levels=(0.68,0.95)):
+	# Former implementation of midsin.Assay.lCbounds
+	ppf = scipy.interpolate.interp1d( cdf, lCvec, bounds_error=False, fill_value=0.0 )
+	subbounds = []
+	for frac in levels:
+		res = scipy.optimize.minimize_scalar(lambda x: ppf(x+frac)-ppf(x),bounds=(0.0,1.0-frac),method='bounded')
+		assert res.success, 'Could not find credible region.'
+		subbounds += list( ppf([res.x,res.x+frac]) )
+	return subbounds
+
+
+def random_assays(nassays, rng):
+	while nassays:
+		ndils, nreps = rng.integers(3,13), rng.integers(2,25)
+		Vinoc, dilmin, dilfac = 0.1, rng.choice([1.0,0.1,0.01]), rng.choice([0.1,0.25,0.5])
+		VDs = Vinoc*dilmin*dilfac**numpy.arange(ndils)
+		lC = rng.uniform(0.5,max(-ndils*numpy.log10(dilfac)-0.5,1.0)) - numpy.log10(Vinoc*dilmin)
+		ninf = rng.binomial(nreps, -numpy.expm1(-10.0**lC*VDs))
+		if 0 < ninf.sum() < nreps*ndils:
+			nassays -= 1
+			yield midsin.Assay(Vinoc, dilmin, dilfac, ninf, [nreps]*ndils, precision=args.precision, usecache=False)
+
+
+parser = argparse.ArgumentParser(description="Benchmark and check the HPD credible bounds of midsin.Assay.lCbounds")
+parser.add_argument('-n','--nassays', type=int, default=200,
+	help='number of random plates (default: 200)')
+parser.add_argument('-p','--precision', choices=list(midsin.precisions), default='standard',
+	help='precision tier of the lCvec grids (default: standard)')
+parser.add_argument('--tol', type=float, default=None,
+	help='largest difference allowed between the two methods (default: 2e-2, 2e-3, 2e-4 for fast, standard, high)')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+if args.tol is None:
+	args.tol = {'fast': 2.0e-2, 'standard': 2.0e-3, 'high': 2.0e-4}[args.precision]
+
+assays = list(random_assays(args.nassays, numpy.random.default_rng(args.seed)))
+tic = time.perf_counter()
+old = numpy.array([minimize_bounds(a.pack['lCvec'], a.pack['cdf']) for a in assays])
+tmin = time.perf_counter()-tic
+tic = time.perf_counter()
+new = numpy.array([a.lCbounds() for a in assays])
+thpd = time.perf_counter()-tic
+# All assays at once, on grids of equal length (as used by AssayBatch)
+ngrid = min(len(a.pack['lCvec']) for a in assays)
+lCvec = numpy.vstack([a.pack['lCvec'][:ngrid] for a in assays])
+pdf = numpy.vstack([a.pack['pdf'][:ngrid] for a in assays])
+tic = time.perf_counter()
+midsin._hpd(lCvec, pdf, (0.68,0.95))
+tbatch = time.perf_counter()-tic
+
+diff = abs(new-old).max()
+print('%-22s %10s' % ('method','ms/assay'))
+print('%-22s %10.4f' % ('interp1d+minimize', 1e3*tmin/len(assays)))
+print('%-22s %10.4f' % ('hpd, one at a time', 1e3*thpd/len(assays)))
+print('%-22s %10.4f' % ('hpd, all at once', 1e3*tbatch/len(assays)))
+print('max |hpd - interp1d+minimize| = %.3g (tol %.3g)' % (diff, args.tol))
+sys.exit(1 if diff > args.tol else 0)
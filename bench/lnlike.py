@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Compares the speed of the vectorized log-likelihood (Assay.lnlike) against
+the former per-dilution loop of scipy.stats.binom.pmf products, on the
+lCdist grid of the example assay and of a 384-well plate layout, along with
+the log10 of the largest likelihood value each one finds on that grid.
+"""
+
+import argparse
+import timeit
+import numpy
+import scipy.stats
+import midsin
+
+
+def loop_lCcalc(idassay, lCvec):
+	# Former implementation of midsin.Assay.lCcalc
+	P = numpy.ones_like(lCvec)
+	for VD,n,k in zip(-idassay.VDs,idassay.pack['ntot'],idassay.pack['ninf']):
+		pinfvec = -numpy.expm1(10.0**lCvec*VD)
+		P *= scipy.stats.binom.pmf(k,n,pinfvec)
+	return P
+
+
+def layouts():
+	ex = midsin.example
+	yield 'example', (ex['Vinoc'], ex['dilmin'], ex['dilfac'], ex['ninf'], ex['ntot'])
+	# 384-well plate: 16 dilutions x 24 repeats, outcome expected for 10^9 SIN/mL
+	Vinoc, dilmin, dilfac = 0.05, 1.0e-3, 0.5
+	VDs = Vinoc * dilmin * dilfac**numpy.arange(16)
+	ninf = numpy.round( 24*-numpy.expm1(-10.0**6.5*VDs) ).astype(int)
+	yield '384-well', (Vinoc, dilmin, dilfac, ninf, [24]*16)
+
+
+parser = argparse.ArgumentParser(description="Benchmark midsin.Assay.lnlike vs the per-dilution binom.pmf loop")
+parser.add_argument('-n','--number', type=int, default=200,
+	help='number of likelihood evaluations timed per layout (default: 200)')
+args = parser.parse_args()
+
+print('%-10s %6s %12s %12s %8s %12s %12s' % ('layout','ngrid','loop (ms)','lnlike (ms)','speedup','loop lmax','lnlike lmax'))
+for name, pars in layouts():
+	idassay = midsin.Assay(*pars)
+	lCvec = idassay.pack['lCvec']
+	tloop = timeit.timeit(lambda: loop_lCcalc(idassay, lCvec), number=args.number)/args.number
+	tvec = timeit.timeit(lambda: idassay.lnlike(lCvec), number=args.number)/args.number
+	print('%-10s %6d %12.4f %12.4f %7.1fx %12.3f %12.3f' % (name, len(lCvec), 1e3*tloop, 1e3*tvec, tloop/tvec,
+		numpy.log10(loop_lCcalc(idassay, lCvec).max()), idassay.lnlike(lCvec).max()/numpy.log(10.)))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Compares the time taken to draw and save one page of graphs (as rendered
+by midsin.utils.render_pages) with text typeset by matplotlib's mathtext
+(the default) and by LaTeX (midsin.plot.usetex), for each output format.
+The first LaTeX rendering of a given string is much slower than the next
+ones, which reuse matplotlib's tex cache: the first round is reported
+separately. LaTeX is skipped if no TeX install is found.
+"""
+
+import argparse
+import io
+import shutil
+import time
+import numpy
+import midsin
+import midsin.plot
+
+
+def random_assays(nassays, rng):
+	while nassays:
+		ndils, nreps = rng.integers(3,13), rng.integers(2,25)
+		Vinoc, dilmin, dilfac = 0.1, rng.choice([1.0,0.1,0.01]), rng.choice([0.1,0.25,0.5])
+		VDs = Vinoc*dilmin*dilfac**numpy.arange(ndils)
+		lC = rng.uniform(0.5,max(-ndils*numpy.log10(dilfac)-0.5,1.0)) - numpy.log10(Vinoc*dilmin)
+		ninf = rng.binomial(nreps, -numpy.expm1(-10.0**lC*VDs))
+		nassays -= 1
+		yield midsin.Assay(Vinoc, dilmin, dilfac, ninf, [nreps]*ndils, usecache=False)
+
+
+def render(assays, labels, fmt, usetex):
+	gridfig = midsin.plot.assay_grid(assays, labels, len(assays), usetex)
+	gridfig.savefig(io.BytesIO(), format=fmt, bbox_inches='tight')
+
+
+parser = argparse.ArgumentParser(description="Benchmark the rendering of midSIN graphs with mathtext and LaTeX text")
+parser.add_argument('-n','--perpage', type=int, default=10,
+	help='number of random plates per page (default: 10)')
+parser.add_argument('-r','--repeat', type=int, default=3,
+	help='number of (timed) renderings of each page after the first (default: 3)')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+assays = list(random_assays(args.perpage, numpy.random.default_rng(args.seed)))
+labels = ['s%d'%i for i in range(len(assays))]
+modes = [('mathtext', False)]
+if shutil.which('latex') and shutil.which('dvipng'):
+	modes.append( ('usetex', True) )
+else:
+	print('LaTeX not found: only timing mathtext')
+
+print('%-10s %-5s %12s %12s' % ('text','fmt','first (s)','next (s)'))
+for name, usetex in modes:
+	for fmt in ('pdf','png','svg'):
+		tic = time.perf_counter()
+		render(assays, labels, fmt, usetex)
+		tfirst = time.perf_counter()-tic
+		tic = time.perf_counter()
+		for r in range(args.repeat):
+			render(assays, labels, fmt, usetex)
+		tnext = (time.perf_counter()-tic)/max(args.repeat,1)
+		print('%-10s %-5s %12.3f %12.3f' % (name, fmt, tfirst, tnext))
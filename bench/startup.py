@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Measures the cold-start time of `midsin --no-plot` on a one-row file (the
+example sample outcome), as the wall time of fresh interpreters and, via
+python -X importtime, the cumulative import time of the main packages. The
+run fails if the median wall time is above --budget, or if a package that
+should only be loaded on demand (matplotlib, scipy) was imported.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import midsin.utils
+
+
+def importtimes(stderr):
+	# Cumulative import time (s) of each package, wherever it is first
+	# imported, and of all imports (those at the top level), from -X importtime
+	times = {}
+	total = 0.0
+	for line in stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		cumul, name = line.split('|')[1:]
+		if not name.startswith('   '):
+			total += 1e-6*int(cumul)
+		name = name.strip()
+		if '.' not in name:
+			times[name] = 1e-6*int(cumul)
+	return times, total
+
+
+parser = argparse.ArgumentParser(description="Benchmark the cold-start time of midsin --no-plot on a one-row file")
+parser.add_argument('-r','--repeat', type=int, default=10,
+	help='number of fresh interpreters timed (default: 10)')
+parser.add_argument('--budget', type=float, default=1.0,
+	help='largest median wall time allowed, in seconds (default: 1.0)')
+parser.add_argument('--script', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','bin','midsin'),
+	help='path to the midsin command-line tool (default: ../bin/midsin)')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmpdir:
+	infile = os.path.join(tmpdir, 'one.csv')
+	with open(infile, 'w', newline='') as f:
+		f.write('\r\n'.join(','.join(map(str,line)) for line in midsin.utils.dict_to_csv(midsin.example))+'\r\n')
+	walls = []
+	for r in range(args.repeat):
+		tic = time.perf_counter()
+		run = subprocess.run([sys.executable, '-X', 'importtime', args.script, '--no-plot', infile], capture_output=True, text=True)
+		walls.append( time.perf_counter()-tic )
+		if run.returncode:
+			sys.exit(run.stderr)
+	times, total = importtimes(run.stderr)
+
+wall = statistics.median(walls)
+print('%-12s %10s' % ('', 'time (s)'))
+print('%-12s %10.3f' % ('wall, median', wall))
+print('%-12s %10.3f' % ('wall, best', min(walls)))
+print('%-12s %10.3f' % ('all imports', total))
+for name in sorted(times, key=times.get, reverse=True)[:8]:
+	print('%-12s %10.3f' % (name, times[name]))
+lazy = [name for name in ('matplotlib','scipy') if name in times]
+if lazy:
+	print('imported although not needed: %s' % ', '.join(lazy))
+print('median wall time %.3f s (budget %.3f s)' % (wall, args.budget))
+sys.exit(1 if wall > args.budget or lazy else 0)
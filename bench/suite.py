@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Times midSIN on fixed synthetic workloads, so that runs can be compared:
+- assay/<layout>/<stage>: midsin.Assay construction (uncached) and each
+  stage of its payload, for the example, empty and full (limit of
+  detection) plates, and 96- and 384-well layouts, and the
+  midsin.PooledAssay of 3 and 300 96-well plates;
+- csv/<n>/...: the csv pipeline (midsin.utils.iter_output, without plots)
+  on 10, 1k and 10k-row files, and csv_to_output (with its figure) on 10;
+- plot/...: rendering a page of 10 assays (pdf, png, svg) and one panel;
+- web/...: the django onesample, batch (until its job is done), batch plot
+  and api/assays views, via the test client on a temporary database;
+- design/...: ranking the 48 default 96-well layouts (midsin.design) on
+  1000 samples each.
+Each benchmark reports the median and best time per call over --repeat
+rounds (a single one for the 10k-row file). The results are printed and,
+with -o, saved as JSON, which --compare contrasts with a previous run.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy
+import midsin
+import midsin.utils
+
+
+def layouts():
+	ex = midsin.example
+	yield 'example', (ex['Vinoc'], ex['dilmin'], ex['dilfac'], ex['ninf'], ex['ntot'])
+	yield 'empty', (ex['Vinoc'], ex['dilmin'], ex['dilfac'], [0]*ex['ndils'], ex['ntot'])
+	yield 'full', (ex['Vinoc'], ex['dilmin'], ex['dilfac'], ex['ntot'], ex['ntot'])
+	# 96-well plate: 12 10-fold dilutions x 8 repeats, for 10^7.3 SIN/mL
+	VDs = 0.1 * 0.1**numpy.arange(12)
+	yield '96-well', (0.1, 1.0, 0.1, numpy.round(8*-numpy.expm1(-10.0**7.3*VDs)).astype(int), [8]*12)
+	# 384-well plate: 16 2-fold dilutions x 24 repeats, for 10^6.5 SIN/mL
+	VDs = 0.05 * 1.0e-3 * 0.5**numpy.arange(16)
+	yield '384-well', (0.05, 1.0e-3, 0.5, numpy.round(24*-numpy.expm1(-10.0**6.5*VDs)).astype(int), [24]*16)
+
+
+def csv_lines(nrows, seed=1):
+	# The example file's header, then nrows random 96-well sample outcomes
+	rng = numpy.random.default_rng(seed)
+	lines = midsin.utils.dict_to_csv(midsin.example)[:1]
+	VDs = 0.1 * 0.01 * 0.1**numpy.arange(11)
+	for i in range(nrows):
+		ninf = rng.binomial(8, -numpy.expm1(-10.0**rng.uniform(3,12)*VDs))
+		lines.append( ['s%d'%i, 0.1, 0.01, 0.1] + [8]*11 + ['#'] + list(ninf) + ['#', ''] )
+	return [[str(a) for a in line] for line in lines]
+
+
+def timeit(func, repeat, number=1, setup=None):
+	# Returns the median and best time per call of func over repeat rounds
+	times = []
+	for r in range(repeat):
+		state = setup() if setup else None
+		tic = time.perf_counter()
+		for n in range(number):
+			func(state) if setup else func()
+		times.append( (time.perf_counter()-tic)/number )
+	return statistics.median(times), min(times)
+
+
+def bench_assay(args):
+	for name, pars in layouts():
+		yield 'assay/%s/construct' % name, lambda: midsin.Assay(*pars, usecache=False), 20
+		base = midsin.Assay(*pars, usecache=False)
+		inputs = {key: base.pack[key] for key in ('Vinoc','dilmin','dilfac','ntot','ninf')}
+		pack0 = dict(base.pack)
+		def fresh(*keys):
+			# An assay whose pack only holds its inputs plus the keys given
+			def setup():
+				base.pack = dict(inputs, **{key: pack0[key] for key in keys if key in pack0})
+				return base
+			return setup
+		stages = [
+			('RMSK', lambda a: midsin.RMSK(numpy.log10(a.VDs), a.pack['ninf'], a.pack['ntot']), fresh()),
+			('lCmode', lambda a: a.lCmode(), fresh()),
+			('lCdist', lambda a: a.lCdist(), fresh('mode','niter')),
+			('lCbounds', lambda a: a.lCbounds(), fresh('lCvec','pdf','cdf','lnpmax')),
+			('mean', lambda a: numpy.trapz(a.pack['lCvec']*a.pack['pdf'],a.pack['lCvec'])/numpy.trapz(a.pack['pdf'],a.pack['lCvec']), fresh('lCvec','pdf')),
+		]
+		for stage, func, setup in stages:
+			yield 'assay/%s/%s' % (name, stage), (func, setup), 20
+	# pooled posterior of 3 and 300 replicate 96-well plates
+	lines = csv_lines(300)[1:]
+	for nassays in (3, 300):
+		inputs = list(zip(*[midsin.utils.parse_line(line) for line in lines[:nassays]]))
+		yield 'assay/pooled/%d' % nassays, lambda inputs=inputs: midsin.PooledAssay(*inputs), 3
+
+
+def bench_csv(args):
+	for nrows in (10, 1000, 10000)[:2 if args.quick else 3]:
+		lines = csv_lines(nrows)
+		def pipeline(lines=lines):
+			midsin.cache.results.clear()
+			for out in midsin.utils.iter_output(lines, errors=[]):
+				pass
+		# at most one round of the larger files
+		yield 'csv/%d/iter_output' % nrows, pipeline, 1 if nrows > 10 else 5, 1 if nrows > 1000 else args.repeat
+	lines = csv_lines(10)
+	def to_output():
+		midsin.cache.results.clear()
+		midsin.utils.csv_to_output(lines, errors=[])
+	yield 'csv/10/csv_to_output', to_output, 1
+
+
+def bench_plot(args):
+	import midsin.plot
+	assays = [(midsin.Assay(*midsin.utils.parse_line(line)), line[0]) for line in csv_lines(10)[1:]]
+	for fmt in ('pdf','png','svg'):
+		def render(fmt=fmt):
+			tmpdir = tempfile.mkdtemp()
+			out = os.path.join(tmpdir, 'out.pdf') if fmt == 'pdf' else tmpdir
+			midsin.utils.render_pages(assays, out, fmt=fmt)
+			shutil.rmtree(tmpdir)
+		yield 'plot/page10/%s' % fmt, render, 1
+	for panel in ('lC_post','observed_wells'):
+		yield 'plot/panel/%s' % panel, lambda panel=panel: midsin.plot.assay_panel(assays[0][0], panel).savefig(io.StringIO(), format='svg'), 3
+
+
+def bench_web(args):
+	# django project on a temporary database and artifact store
+	tmpdir = tempfile.mkdtemp()
+	os.environ.setdefault('MIDSIN_WEB_PATH', os.path.join(os.path.dirname(midsin.__file__), 'web'))
+	os.environ['DJANGO_SETTINGS_MODULE'] = 'midsin.web.settings.devel'
+	os.environ['MIDSIN_ARTIFACT_PATH'] = os.path.join(tmpdir, 'artifacts')
+	import django
+	from django.conf import settings
+	django.setup()
+	from django.db import connection
+	from django.test import Client
+	from django.test.utils import setup_test_environment
+	settings.ALLOWED_HOSTS = ['testserver']
+	connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'db.sqlite3')
+	setup_test_environment()
+	connection.creation.create_test_db(verbosity=0, serialize=False)
+	client = Client()
+	ex = midsin.example
+	query = dict(ex, ntot=' '.join(map(str,ex['ntot'])), ninf=' '.join(map(str,ex['ninf'])))
+	yield 'web/onesample', lambda: client.get('/onesample', query), 3
+	for nrows in (10, 100):
+		text = '\r\n'.join(','.join(line) for line in csv_lines(nrows))
+		def batch(text=text):
+			midsin.cache.results.clear()
+			upload = io.BytesIO(text.encode()); upload.name = 'batch.csv'
+			loc = client.post('/batch', {'file': upload})['Location']
+			while client.get(loc+'/status').json()['status'] not in ('done','failed'):
+				time.sleep(0.05)
+			bench_web.job = loc
+		yield 'web/batch/%d' % nrows, batch, 1
+	yield 'web/batch_job_page', lambda: client.get(bench_web.job), 5
+	yield 'web/batch_plot', lambda: client.get(bench_web.job+'/2/lC_post.svg'), 3
+	lines = csv_lines(1000)[1:]
+	body = '\n'.join(json.dumps({'name':line[0], 'Vinoc':0.1, 'dilmin':0.01, 'dilfac':0.1, 'ntot':[8]*11, 'ninf':list(map(int,line[16:27]))}) for line in lines)
+	def api():
+		b''.join(client.post('/api/assays', body, content_type='application/x-ndjson').streaming_content)
+	yield 'web/api/1000', api, 1
+
+
+def bench_design(args):
+	import midsin.design
+	yield 'design/rank/48x1000', lambda: midsin.design.rank((4.0,9.0), budget=96, nsamples=1000), 1
+
+
+def bench_simulate(args):
+	import midsin.simulate
+	yield 'simulate/coverage/9x10000', lambda: midsin.simulate.coverage(numpy.arange(2.5,11.0), nplates=10000), 1
+
+
+groups = {'assay': bench_assay, 'csv': bench_csv, 'plot': bench_plot, 'web': bench_web, 'design': bench_design, 'simulate': bench_simulate}
+
+parser = argparse.ArgumentParser(description="Benchmark suite of midSIN's core engine, csv pipeline, plotting and web views")
+parser.add_argument('groups', nargs='*', default=list(groups),
+	help='groups of benchmarks to run, among %s (default: all)' % ', '.join(groups))
+parser.add_argument('-r','--repeat', type=int, default=3,
+	help='number of rounds timed per benchmark (default: 3)')
+parser.add_argument('-o','--output', type=str, default=None,
+	help='JSON file where the results are saved')
+parser.add_argument('--compare', type=str, default=None,
+	help='JSON file of a previous run to compare the results to')
+parser.add_argument('--quick', action='store_true',
+	help='skip the 10k-row csv file')
+args = parser.parse_args()
+for group in args.groups:
+	if group not in groups:
+		parser.error('unknown group %s' % group)
+
+try:
+	commit = subprocess.run(['git','rev-parse','--short','HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+except OSError:
+	commit = ''
+report = {
+	'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(), 'repeat': args.repeat},
+	'results': {},
+}
+previous = json.load(open(args.compare))['results'] if args.compare else {}
+
+print('%-32s %12s %12s %9s' % ('benchmark','median (s)','best (s)','vs prev'))
+for group in args.groups:
+	for name, func, number, *rounds in groups[group](args):
+		func, setup = func if isinstance(func, tuple) else (func, None)
+		median, best = timeit(func, min([args.repeat]+rounds), number, setup)
+		report['results'][name] = {'median': median, 'best': best, 'number': number}
+		ratio = '%8.2fx' % (median/previous[name]['median']) if name in previous else ''
+		print('%-32s %12.6f %12.6f %9s' % (name, median, best, ratio))
+		sys.stdout.flush()
+
+if args.output:
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+Measures the throughput, in assays/second, of midsin.Assay (uncached) on
+random sample outcomes of a fixed 96-well layout (11 10-fold dilutions x 8
+repeats), with the likelihood computed from the table of its midsin.Layout
+(built once, whose time is reported separately) or directly on an adaptive
+grid, and of midsin.AssayBatch for reference. The results are printed and,
+with -o, saved as JSON.
+"""
+
+import argparse
+import json
+import platform
+import time
+import numpy
+import midsin
+
+
+parser = argparse.ArgumentParser(description="Benchmark the throughput of midsin.Assay on a fixed 96-well layout, with and without its precomputed Layout")
+parser.add_argument('-n','--nassays', type=int, default=2000,
+	help='number of random sample outcomes analysed (default: 2000)')
+parser.add_argument('-p','--precision', type=str, default='standard', choices=list(midsin.precisions),
+	help='precision tier (default: standard)')
+parser.add_argument('-o','--output', type=str, default=None,
+	help='JSON file where the results are saved')
+args = parser.parse_args()
+
+# Sample outcomes of 10^3 to 10^12 SIN/mL, limits of detection included
+Vinoc, dilmin, dilfac, ntot = 0.1, 0.01, 0.1, [8]*11
+rng = numpy.random.default_rng(1)
+VDs = Vinoc * dilmin * dilfac**numpy.arange(len(ntot))
+ninfs = [rng.binomial(ntot, -numpy.expm1(-10.0**rng.uniform(3,12)*VDs)) for i in range(args.nassays)]
+
+results = {}
+midsin._layout.cache_clear()
+tic = time.perf_counter()
+midsin.layout(Vinoc, dilmin, dilfac, ntot, args.precision)
+results['layout_seconds'] = time.perf_counter()-tic
+for name, uselayout in (('assay_layout',True),('assay_adaptive',False)):
+	tic = time.perf_counter()
+	for ninf in ninfs:
+		midsin.Assay(Vinoc, dilmin, dilfac, ninf, ntot, precision=args.precision, usecache=False, uselayout=uselayout)
+	results[name] = args.nassays/(time.perf_counter()-tic)
+tic = time.perf_counter()
+midsin.AssayBatch(Vinoc, dilmin, dilfac, ninfs, [ntot]*args.nassays, precision=args.precision)
+results['assaybatch'] = args.nassays/(time.perf_counter()-tic)
+
+print('%-16s %12s' % ('', 'assays/s'))
+for name in ('assay_layout','assay_adaptive','assaybatch'):
+	print('%-16s %12.1f' % (name, results[name]))
+print('layout built in %.3f s, %.2fx the throughput without it' % (results['layout_seconds'], results['assay_layout']/results['assay_adaptive']))
+
+if args.output:
+	meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'numpy': numpy.__version__, 'nassays': args.nassays, 'precision': args.precision}
+	with open(args.output, 'w') as f:
+		json.dump({'meta': meta, 'results': results}, f, indent=1)
@@ -29,6 +29,7 @@ setup(
 	packages = [
 		"midsin",
 		"midsin.web",
+		"midsin.web.migrations",
 		"midsin.web.settings",
 	],
 	package_dir = {"midsin":"src"},
@@ -43,8 +44,11 @@ setup(
 	install_requires = [
 		"matplotlib",
 		"numpy",
-		"scipy",
 	],
+	extras_require = {
+		# bench/hpd.py and bench/lnlike.py compare to the former scipy code
+		"bench": ["scipy"],
+	},
 	classifiers = [
 		"Development Status :: 3 - Alpha",
 		"Framework :: Django",
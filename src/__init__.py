@@ -17,17 +17,21 @@
 #
 # =============================================================================
 
+import functools
+import math
 import numpy
-import scipy.interpolate
-import scipy.optimize
-import scipy.stats
+from midsin import cache
+from midsin import timing
 
 
 # Columns of csv input file
 incols = ['name','Vinoc','dilmin','dilfac','ntot','ninf','comments']
 
 # Columns added to csv output file
-outcols = ['mode','68lb','68ub','95lb','95ub','RM','SK']
+outcols = ['mode','68lb','68ub','95lb','95ub','RM','SK','LOD']
+
+# Posterior grids of the pack of an Assay, only needed to plot it
+grids = ['lCvec','pdf','cdf']
 
 # label/header for assay parameters
 label = {
@@ -42,6 +46,7 @@ label = {
 	'ntot': "# wells total",
 	'comments': "Comment (optional)",
 	# output
+	'nassays': "# replicates pooled",
 	'mode': 'mode log10(SIN/mL)',
 	'68lb': '68%CI-lo log10(SIN/mL)',
 	'68ub': '68%CI-hi log10(SIN/mL)',
@@ -49,6 +54,7 @@ label = {
 	'95ub': '95%CI-hi log10(SIN/mL)',
 	'RM': 'RM log10(TCID50/mL)',
 	'SK': 'SK log10(TCID50/mL)',
+	'LOD': 'LOD log10(SIN/mL)',
 }
 
 # help_text associated with assay parameters
@@ -77,7 +83,22 @@ example = {
 	'comments': '',
 }
 
+# Tolerance on the CDF of the adaptive lCvir grid of lCdist for each
+# precision tier, with the resulting maximum error on the 68% and 95% bounds
+# and # of likelihood evaluations (the former fixed grid: 1e-3, 1200 evals).
+# The errors are the largest measured against a 1e-10 tier, with or without
+# layout, which occur for the skewed posteriors of very few infected wells
+precisions = {
+	'fast': 1.0e-3, # 5e-3, ~90 evals
+	'standard': 1.0e-5, # 1.5e-4, ~700 evals
+	'high': 1.0e-7, # 2e-6, ~7000 evals
+}
+
+# Largest # of wells per dilution (ntot) accepted from the input
+maxwells = 10**6
 
+
+@timing.timed('RMSK')
 def RMSK(dilut,Npos,Ntot):
 	# if only one well
 	if len(Npos) < 2:
@@ -105,10 +126,330 @@ def RMSK(dilut,Npos,Ntot):
 	return (RM,SK)
 
 
+def _RMSK(dilut,Npos,Ntot,ndils):
+	""" Vectorized RMSK for each row of the 2-D arrays dilut, Npos and Ntot, whose entries beyond the first ndils of each row are padding. Returns the (RM,SK) arrays, with the same nan cases as RMSK. """
+	rows = numpy.arange(Npos.shape[0])
+	if Npos.shape[1] < 2:
+		return (numpy.full(len(rows),numpy.nan),)*2
+	mask = numpy.arange(Npos.shape[1]) < ndils[:,None]
+	Npos = numpy.where(mask,Npos,0)
+	Nneg = numpy.where(mask,Ntot-Npos,0)
+	valid = (ndils > 1) * (Npos.sum(axis=1) > 0) * (Nneg.sum(axis=1) > 0)
+	df = abs( dilut[:,1]-dilut[:,0] )
+	with numpy.errstate(divide='ignore',invalid='ignore'):
+		# Reed-Muench, where idx=-1 stands for the last (unpadded) dilution
+		frac = 1.0*numpy.cumsum(Npos[:,::-1],axis=1)[:,::-1]
+		frac = frac/(frac+numpy.cumsum(Nneg,axis=1))
+		jdx = numpy.argmax((frac < 0.5)*mask,axis=1)
+		idx = numpy.where(jdx == 0, ndils-1, jdx-1)
+		propdist = (frac[rows,idx]-0.5)/(frac[rows,idx]-frac[rows,jdx])
+		RM = df*propdist - dilut[rows,idx]
+		# Spearman-Kaerber, with frac=1 prepended if frac<1 in lowest dilution
+		frac = numpy.where(mask,1.0*Npos/Ntot,0.0)
+		idx = numpy.argmin((frac < 1.0)+~mask,axis=1)
+		pairs = numpy.arange(Npos.shape[1]-1)
+		pairs = (pairs >= idx[:,None]) * (pairs < ndils[:,None]-1)
+		area = numpy.sum(0.5*(frac[:,1:]+frac[:,:-1])*pairs,axis=1)
+		SK = numpy.where(idx == 0, df*(area+0.5*(1.0+frac[:,0]))-dilut[:,0]-df, df*area-dilut[rows,idx])
+	return (numpy.where(valid,RM,numpy.nan),numpy.where(valid,SK,numpy.nan))
+
+
+def _lnlike_derivs(lC, VDs, ntot, ninf):
+	""" Computes the first and second derivatives with respect to lC of the log-likelihood computed by lnlike, for each row of VDs, ntot and ninf (dilutions along the last axis) and corresponding element of the 1-D array lC. With u=C*V*D, the derivative of each dilution's term is ln(10)*[k*r-(n-k)*u] with r=u/(exp(u)-1), and the second derivative is ln(10)^2*[k*r*(1-s)-(n-k)*u] with s=u/(1-exp(-u)). """
+	CVD = VDs * 10.0**lC[:,None]
+	with numpy.errstate(divide='ignore',over='ignore',invalid='ignore'):
+		r = numpy.where(CVD > 0.0, CVD/numpy.expm1(CVD), 1.0)
+		s = numpy.where(CVD > 0.0, -CVD/numpy.expm1(-CVD), 1.0)
+	ln10 = numpy.log(10.0)
+	dlnP = ln10*numpy.sum(ninf*r-(ntot-ninf)*CVD,axis=1)
+	d2lnP = ln10**2*numpy.sum(ninf*r*(1.0-s)-(ntot-ninf)*CVD,axis=1)
+	return dlnP, d2lnP
+
+
+def _newton_mode(VDs, ntot, ninf, xtol=1.0e-10, maxiter=100, bracket=None):
+	""" Computes the mode of the posterior PDF for lCvir for each row of the 2-D arrays VDs, ntot and ninf (padded dilutions having VDs=0 and ntot=ninf=0), none of which can be a limit of detection assay. The log-likelihood is concave in lC, so its derivative is bracketed between 6 decades below/above the largest/smallest VD (or by the (lo,hi) arrays of bracket, if known) and Newton steps falling outside the bracket are replaced by bisection. Returns the modes and the number of iterations each took to converge. """
+	rows = numpy.arange(len(VDs))
+	if bracket is not None:
+		# Start from the middle of the given bracket
+		lo, hi = (numpy.array(a,dtype=float) for a in bracket)
+		x = 0.5*(lo+hi)
+	else:
+		lo = -numpy.log10(VDs.max(axis=1))-6.0
+		hi = -numpy.log10(numpy.where(VDs > 0.0, VDs, numpy.inf).min(axis=1))+6.0
+		# Widen the bracket, should the derivative not change sign within it
+		for x, sign in ((lo,-1.0),(hi,1.0)):
+			while True:
+				bad = sign*_lnlike_derivs(x, VDs, ntot, ninf)[0] >= 0.0
+				if not bad.any():
+					break
+				x[bad] += sign*6.0
+		# Start from the first dilution with uninfected wells
+		x = -numpy.log10(VDs[rows,numpy.argmax(ntot > ninf,axis=1)])
+	niter = numpy.zeros(len(rows),dtype=int)
+	todo = rows
+	for i in range(maxiter):
+		dlnP, d2lnP = _lnlike_derivs(x[todo], VDs[todo], ntot[todo], ninf[todo])
+		lo[todo] = numpy.where(dlnP > 0.0, x[todo], lo[todo])
+		hi[todo] = numpy.where(dlnP > 0.0, hi[todo], x[todo])
+		with numpy.errstate(divide='ignore',invalid='ignore'):
+			xnew = x[todo] - dlnP/d2lnP
+		done = (abs(xnew-x[todo]) < xtol) + (hi[todo]-lo[todo] < xtol)
+		bisect = ~((lo[todo] < xnew) * (xnew < hi[todo])) * ~done
+		xnew[bisect] = 0.5*(lo[todo]+hi[todo])[bisect]
+		niter[todo] += 1
+		x[todo] = xnew
+		todo = todo[~done]
+		if len(todo) == 0:
+			break
+	assert len(todo) == 0, 'Could not find lC mode'
+	return x, niter
+
+
+def _lod_quantile(VDs, ntot, isfull, p, xtol=1.0e-10, maxiter=100):
+	""" Computes the lCvir value where the likelihood (whose maximum is 1) is p (a scalar or one value per row), for each row of the 2-D arrays VDs and ntot (padded dilutions having VDs=0 and ntot=0) of a limit of detection assay, isfull being whether all (else none) of its wells are infected. With no infected well, the likelihood is exp(-C*sum(ntot*VDs)) and lC=log10(-ln(p)/sum(ntot*VDs)). With all wells infected, it is the product of q**ntot with q=1-exp(-C*VDs), which is bracketed by the lC where (1-exp(-C*VD))**sum(ntot) is p for the largest and smallest VD, and solved for by Newton's method on the analytic derivative from the upper end of the bracket, steps falling outside the bracket being replaced by bisection. """
+	lnp = numpy.log(numpy.broadcast_to(p, isfull.shape))
+	x = numpy.log10(-lnp/numpy.sum(ntot*VDs,axis=1))
+	rows = numpy.where(isfull)[0]
+	if len(rows) == 0:
+		return x
+	VDs, ntot, lnp = VDs[rows], ntot[rows], lnp[rows]
+	lnC = numpy.log(-numpy.log(-numpy.expm1(lnp/ntot.sum(axis=1))))
+	lo = (lnC-numpy.log(VDs.max(axis=1)))/numpy.log(10.0)
+	hi = (lnC-numpy.log(numpy.where(VDs > 0.0, VDs, numpy.inf).min(axis=1)))/numpy.log(10.0)
+	xfull = hi.copy()
+	todo = numpy.arange(len(rows))
+	for i in range(maxiter):
+		CVD = VDs[todo] * 10.0**xfull[todo,None]
+		q = numpy.where(ntot[todo] > 0, -numpy.expm1(-CVD), 1.0)
+		g = numpy.sum(ntot[todo]*numpy.log(q),axis=1) - lnp[todo]
+		dg = numpy.log(10.0)*numpy.sum(ntot[todo]*CVD*(1.0-q)/q,axis=1)
+		xnew = xfull[todo] - g/dg
+		lo[todo] = numpy.where(g < 0.0, xfull[todo], lo[todo])
+		hi[todo] = numpy.where(g < 0.0, hi[todo], xfull[todo])
+		done = (abs(xnew-xfull[todo]) < xtol) + (hi[todo]-lo[todo] < xtol)
+		bisect = ~((lo[todo] < xnew) * (xnew < hi[todo])) * ~done
+		xnew[bisect] = 0.5*(lo[todo]+hi[todo])[bisect]
+		xfull[todo] = xnew
+		todo = todo[~done]
+		if len(todo) == 0:
+			break
+	x[rows] = xfull
+	return x
+
+
+def _adaptive_grid(lnpdf, mode, width, tol, maxlevel=20):
+	""" Builds an lCvir grid for each element of mode, starting from a coarse grid spanning +/-8 widths around the mode (extended while the PDF at its ends is not negligible) whose intervals are repeatedly halved wherever the CDF error, from either the trapezoid rule or its linear interpolation, exceeds tol. The function lnpdf takes a 2-D array of lCvir values, one row per mode, and returns the log-likelihood. All rows share the same grid in units of their width, refined wherever any row needs it. Returns the lCvec and lnpdf 2-D arrays. """
+	lnpmax = lnpdf(mode[:,None])
+	f = lambda z: numpy.exp(lnpdf(mode[:,None]+width[:,None]*z)-lnpmax)
+	z = numpy.linspace(-8.0,8.0,17)
+	pdf = f(z)
+	# Extend the grid until the PDF at either end is negligible
+	while pdf[:,0].max() > 1.0e-3*tol:
+		znew = z[0]-numpy.arange(8.0,0.0,-1.0)
+		z, pdf = numpy.hstack((znew,z)), numpy.hstack((f(znew),pdf))
+	while pdf[:,-1].max() > 1.0e-3*tol:
+		znew = z[-1]+numpy.arange(1.0,9.0)
+		z, pdf = numpy.hstack((z,znew)), numpy.hstack((pdf,f(znew)))
+	mass = numpy.trapz(pdf,z,axis=1)[:,None]
+	refine = numpy.ones(len(z)-1,dtype=bool)
+	for level in range(maxlevel):
+		idx = numpy.where(refine)[0]
+		if len(idx) == 0:
+			break
+		zmid = 0.5*(z[idx]+z[idx+1])
+		pmid = f(zmid)
+		# Difference in CDF between the trapezoid rule on the interval and
+		# on its two halves, and between the CDF and its linear interpolation
+		h = z[idx+1]-z[idx]
+		err = abs(pdf[:,idx]-2.0*pmid+pdf[:,idx+1])*h/4.0
+		err = numpy.maximum(err, abs(pdf[:,idx+1]-pdf[:,idx])*h/8.0)
+		bad = (err/mass > tol).any(axis=0)
+		z, pdf = numpy.insert(z,idx+1,zmid), numpy.insert(pdf,idx+1,pmid,axis=1)
+		refine[idx] = bad
+		refine = numpy.insert(refine,idx+1,bad)
+	with numpy.errstate(divide='ignore'):
+		return mode[:,None]+width[:,None]*z, numpy.log(pdf)+lnpmax
+
+
+def _crossing(lCvec, pdf, mass):
+	""" Returns a function finding, for each row of the 2-D lCvec, pdf and mass (CDF before normalization) arrays, where the piecewise-linear pdf first crosses the level(s) t going from the start of the row towards the mode. That function returns the lCvir value of each crossing and the mass up to it from the start of the row, along with the coefficients c and a such that this mass is c+a*t**2 for any level t crossing within the same grid interval. """
+	nrows, ngrid = pdf.shape
+	rows = numpy.arange(nrows)[:,None]
+	# Increasing pdf up to the mode, offset by row to search all rows at once
+	imax = numpy.argmax(pdf,axis=1)[:,None]
+	seq = numpy.arange(ngrid)
+	seq = (numpy.where(seq <= imax, pdf, 1.0+(seq-imax)/ngrid) + 2.0*rows).ravel()
+	def crossing(t):
+		idx = numpy.searchsorted(seq,(t+2.0*rows).ravel(),side='right').reshape(t.shape)
+		idx = numpy.clip(idx-1-ngrid*rows,0,ngrid-2)
+		p0, p1 = pdf[rows,idx], pdf[rows,idx+1]
+		x0, x1 = lCvec[rows,idx], lCvec[rows,idx+1]
+		with numpy.errstate(all='ignore'):
+			frac = numpy.clip(numpy.where(p1 > p0,(t-p0)/(p1-p0),0.0),0.0,1.0)
+			a = numpy.where(p1 > p0,0.5*abs(x1-x0)/(p1-p0),0.0)
+			x = x0+frac*(x1-x0)
+			m = mass[rows,idx]+0.5*abs(x-x0)*(2.0*p0+frac*(p1-p0))
+			return x, m, m-a*t**2, a
+	return crossing
+
+
+def _hpd(lCvec, pdf, levels, nthresh=1024, niter=3):
+	""" Computes the highest posterior density (shortest) credible interval containing each fraction in levels, for each row of the 2-D lCvec and corresponding (unimodal) pdf arrays. The interval is bounded where the piecewise-linear pdf crosses the density threshold t whose enclosed (trapezoid-rule) mass is the desired fraction. The enclosed mass is first computed for thresholds at the sorted pdf values (or nthresh of them spread over these for larger grids), to bracket each fraction. As long as the crossings stay within the same grid intervals, the mass is c-a*t**2 and t can be solved for exactly: once if the bracketing thresholds are consecutive pdf values, else niter times from the crossings of the last t. Returns an array of shape (rows,2*len(levels)) as [lower,upper] pairs for each level. """
+	rows = numpy.arange(len(pdf))[:,None]
+	pdf = pdf/pdf.max(axis=1)[:,None]
+	mass = numpy.cumsum(0.5*(pdf[:,1:]+pdf[:,:-1])*numpy.diff(lCvec,axis=1),axis=1)
+	mass = numpy.hstack((numpy.zeros((len(pdf),1)),mass))
+	# Mass left of a point is measured from the left end of the grid, and
+	# mass right of a point from the right end of the (reversed) grid
+	left = _crossing(lCvec,pdf,mass)
+	right = _crossing(lCvec[:,::-1],pdf[:,::-1],mass[:,-1:]-mass[:,::-1])
+	target = mass[:,-1:]*numpy.array(levels)[None,:]
+	# Enclosed mass for thresholds spread over the pdf values (decreasing)
+	tgrid = numpy.sort(pdf,axis=1)
+	tgrid = tgrid[:,numpy.unique(numpy.linspace(0,pdf.shape[1]-1,nthresh).astype(int))]
+	inside = mass[:,-1:]-left(tgrid)[1]-right(tgrid)[1]
+	idx = numpy.clip((inside[:,:,None] >= target[:,None,:]).sum(axis=1)-1,0,tgrid.shape[1]-2)
+	tlo, thi = tgrid[rows,idx], tgrid[rows,idx+1]
+	t = 0.5*(tlo+thi)
+	for i in range(1 if tgrid.shape[1] == pdf.shape[1] else niter):
+		cl, al = left(t)[2:]
+		cr, ar = right(t)[2:]
+		with numpy.errstate(divide='ignore',invalid='ignore'):
+			tnew = numpy.sqrt((mass[:,-1:]-cl-cr-target)/(al+ar))
+		t = numpy.clip(numpy.where(numpy.isfinite(tnew),tnew,t),tlo,thi)
+	bounds = (left(t)[0], right(t)[0])
+	return numpy.stack(bounds,axis=2).reshape(len(pdf),2*len(levels))
+
+
+_lnfacts = None
+def _lnfact(n):
+	""" Returns ln(n!) for the integers in array n, looked up in a table (computed on first use) for n < 10^4 and computed by math.lgamma otherwise. """
+	global _lnfacts
+	if _lnfacts is None:
+		_lnfacts = numpy.array([math.lgamma(i+1.0) for i in range(10**4)])
+	n = numpy.asarray(n, dtype=int)
+	big = n >= len(_lnfacts)
+	if not big.any():
+		return _lnfacts[n]
+	lnf = _lnfacts[numpy.where(big, 0, n)]
+	lnf[big] = [math.lgamma(i+1.0) for i in n[big]]
+	return lnf
+
+
+@timing.timed('lnlike')
+def lnlike(lCvec, VDs, ntot, ninf):
+	""" Computes the log-likelihood of observing ninf infected wells out of ntot wells at each dilution, where each dilution received volume*dilution VDs of sample, for every log10 SIN/mL value in lCvec. The dilutions (last axis of VDs, ntot, ninf) are broadcast against the grid (last axis of lCvec) as a single (..., dilution, grid) array of log-binomial terms, which is then summed over dilutions. """
+	ntot = numpy.asarray(ntot)[...,None]
+	ninf = numpy.asarray(ninf)[...,None]
+	# Poisson-distributed # of infections per well: lnq = -C*V*D
+	CVD = numpy.asarray(VDs)[...,None] * 10.0**numpy.asarray(lCvec)[...,None,:]
+	timing.count('lnlike_points', CVD.size//CVD.shape[-2])
+	with numpy.errstate(divide='ignore'):
+		lnP = ninf*numpy.log(numpy.where(ninf > 0, -numpy.expm1(-CVD), 1.0)) - (ntot-ninf)*CVD
+	# ln of the binomial coefficients, constant in lC
+	lnbc = _lnfact(ntot) - _lnfact(ninf) - _lnfact(ntot-ninf)
+	return lnP.sum(axis=-2) + lnbc.sum(axis=-2)
+
+
+class Layout(object):
+	""" The lCvir grid and table of log-probabilities shared by the assays with the same Vinoc, dilmin, dilfac and ntot, which only differ by ninf (e.g. the plates of a screen). The log-likelihood of an assay, sum(ninf*ln(1-exp(-C*VDs)) - (ntot-ninf)*C*VDs) plus its binomial coefficients, is linear in ninf, such that once the (dilution x grid point) table of ln(1-exp(-C*VDs)) is computed, the log-likelihood of any assay of the layout on the grid is a weighted sum of its rows. The grid is uniform, spans 6 decades beyond the dilutions, and its step (a power of 2) is fine enough at precision tolerance tol for the narrowest posterior of the layout, as given by the largest Fisher information of its dilutions: assays with wider posteriors use every 2nd, 4th, ... point of it. """
+	@timing.timed('layout')
+	def __init__(self, Vinoc, dilmin, dilfac, ntot, tol):
+		self.ntot = numpy.array(ntot)
+		self.VDs = Vinoc * dilmin * dilfac**numpy.arange(len(self.ntot))
+		self.tol = tol
+		lo = -numpy.log10(self.VDs.max())-6.0
+		hi = -numpy.log10(self.VDs.min())+6.0
+		# Fisher information of the dilutions, the inverse of the squared
+		# width of the narrowest posterior
+		CVD = self.VDs[:,None] * 10.0**numpy.linspace(lo,hi,4096)
+		with numpy.errstate(over='ignore'):
+			info = numpy.log(10.0)**2*numpy.sum(self.ntot[:,None]*CVD**2/numpy.expm1(CVD),axis=0)
+		self.wmin = 1.0/numpy.sqrt(info.max())
+		self.step = 2.0**numpy.floor(numpy.log2(self.max_step(self.wmin)))
+		# Stride of the coarse grid, about wmin, in which the mode is sought
+		self.coarse = int(2.0**max(0.0,numpy.floor(numpy.log2(self.wmin/self.step))))
+		first = numpy.floor(lo/(self.step*self.coarse))*self.coarse
+		npts = int(numpy.ceil((hi-lo)/(self.step*self.coarse)))*self.coarse+1
+		self.lCvec = (first+numpy.arange(npts))*self.step
+		self.C = 10.0**self.lCvec
+		self.lnpinf = numpy.log(-numpy.expm1(-self.VDs[:,None]*self.C))
+
+	def max_step(self, width):
+		""" Returns the largest grid step for a posterior of the given width such that its bounds and mean are within the precision tolerance's error (see precisions). """
+		return 6.0*width*numpy.sqrt(self.tol)
+
+	@timing.timed('lnlike')
+	def lnlike(self, ninf, cols):
+		""" Computes the log-likelihood of ninf infected wells, without its binomial coefficients, at the grid points cols (indices or a slice of lCvec). """
+		timing.count('lnlike_points', len(self.C[cols]))
+		return numpy.dot(ninf,self.lnpinf[:,cols]) - numpy.dot(self.ntot-ninf,self.VDs)*self.C[cols]
+
+	def bracket(self, ninf):
+		""" Returns the (lo,hi) lCvir values between which the mode of the posterior for ninf infected wells lies, as the coarse grid points either side of the largest likelihood on the coarse grid, or None if it lies at the edge of the grid. """
+		lnp = self.lnlike(ninf, slice(None,None,self.coarse))
+		j = numpy.argmax(lnp)
+		if j == 0 or j == len(lnp)-1:
+			return None
+		return self.lCvec[(j-1)*self.coarse], self.lCvec[(j+1)*self.coarse]
+
+	def lCdist(self, ninf, mode, width):
+		""" Returns the lCvec and lnpdf arrays of the posterior for ninf infected wells, whose mode and width are given, on the grid points whose pdf is above 1e-3 times the precision tolerance (plus one either side) using every stride-th grid point for its width, with the mode inserted, or None should the posterior extend past the grid. """
+		lnbc = numpy.sum(_lnfact(self.ntot) - _lnfact(ninf) - _lnfact(self.ntot-ninf))
+		lnmode = lnlike(numpy.array([mode]), self.VDs, self.ntot, ninf)[0]
+		threshold = lnmode - lnbc + numpy.log(1.0e-3*self.tol)
+		# Coarse grid points above threshold, and the one past them either side
+		above = numpy.flatnonzero(self.lnlike(ninf, slice(None,None,self.coarse)) > threshold)
+		if len(above) == 0 or above[0] == 0 or (above[-1]+1)*self.coarse >= len(self.lCvec):
+			return None
+		stride = 2.0**numpy.floor(numpy.log2(self.max_step(width)/self.step))
+		stride = int(numpy.clip(stride,1,self.coarse))
+		cols = numpy.arange((above[0]-1)*self.coarse, (above[-1]+1)*self.coarse+1, stride)
+		lnpdf = self.lnlike(ninf, cols)
+		above = numpy.flatnonzero(lnpdf > threshold)
+		keep = slice(max(above[0]-1,0), above[-1]+2)
+		lCvec, lnpdf = self.lCvec[cols[keep]], lnpdf[keep]+lnbc
+		idx = numpy.searchsorted(lCvec, mode)
+		return numpy.insert(lCvec,idx,mode), numpy.insert(lnpdf,idx,lnmode)
+
+
+@functools.lru_cache(maxsize=8)
+def _layout(Vinoc, dilmin, dilfac, ntot, tol):
+	return Layout(Vinoc, dilmin, dilfac, ntot, tol)
+
+
+def layout(Vinoc, dilmin, dilfac, ntot, precision='standard'):
+	""" Returns the Layout of the assays with these Vinoc, dilmin, dilfac and ntot at the given precision, shared by every Assay of that layout in this process (the 8 most recently used ones are kept). """
+	return _layout(float(Vinoc), float(dilmin), float(dilfac), tuple(int(a) for a in ntot), precisions.get(precision, precision))
+
+
+class Result(object):
+	""" The results of an Assay without its inputs nor grids, e.g. to keep those of a large batch: its outcols as values (in that order, also accessed by key as result['68lb']), its mean, and whether it is a limit of detection assay (isempty, isfull). """
+	__slots__ = ('values','mean','isempty','isfull')
+
+	def __init__(self, values, mean, isempty, isfull):
+		self.values = tuple(values)
+		self.mean = mean
+		self.isempty = isempty
+		self.isfull = isfull
+
+	def __getitem__(self, key):
+		return self.values[outcols.index(key)]
+
+	def __repr__(self):
+		return 'Result(%s)' % ', '.join('%s=%r' % (key,val) for key,val in zip(outcols+['mean'],self.values+(self.mean,)))
+
+
 class Assay(object):
-	def __init__(self, Vinoc, dilmin, dilfac, ninf, ntot):
+	__slots__ = ('pack','tol','nmks','isempty','isfull','VDs','timings','uselayout','__dict__')
+
+	def __init__(self, Vinoc, dilmin, dilfac, ninf, ntot, precision='standard', usecache=True, timed=None, keep_grid=True, uselayout=True):
 		# Save user input
 		self.pack = {'Vinoc':Vinoc, 'dilmin':dilmin, 'dilfac':dilfac}
+		# Tolerance of the lCvir grid, as a tier of precisions or a float
+		self.tol = precisions.get(precision, precision)
+		# Whether the likelihood is computed from the table of its Layout
+		self.uselayout = uselayout
 		# computer n (# of unspoiled wells)
 		self.pack['ntot'] = numpy.array(ntot)
 		# Compute k (# of wells infected)
@@ -127,11 +468,49 @@ class Assay(object):
 			self.isfull = False
 		# Compute arg of lnqbase = exp[ - Vinoc * dilmin * dilfac^pow ]
 		self.VDs = Vinoc * dilmin * dilfac**numpy.arange(len(self.nmks))
-		# Compute the remainder of the assay payload
-		self.payload()
+		# Record the time spent in each stage, if enabled (see midsin.timing)
+		self.timings = timing.Timings() if (timing.enabled if timed is None else timed) else None
+		with timing.recording(self.timings):
+			# Compute the remainder of the assay payload, unless it was cached
+			pack = None
+			if usecache:
+				with timing.stage('cache'):
+					key = cache.key(Vinoc, dilmin, dilfac, ninf, ntot, tol=self.tol, uselayout=self.uselayout)
+					pack = cache.results.get(key)
+			if pack is None:
+				self.payload()
+				if usecache:
+					with timing.stage('cache'):
+						cache.results.put(key, self.pack)
+			else:
+				self.pack = pack
+		self.keep_grid(keep_grid)
+
+	def keep_grid(self, keep_grid):
+		""" Keeps the lCvec, pdf and cdf grids (if keep_grid, computed again by lCdist if needed), as float32 if keep_grid is 'float32', or drops them. """
+		if keep_grid and 'pdf' not in self.pack:
+			self.lCdist()
+		if keep_grid == 'float32':
+			for key in grids:
+				self.pack[key] = self.pack[key].astype(numpy.float32)
+		elif not keep_grid:
+			for key in grids:
+				self.pack.pop(key, None)
 
+	def result(self):
+		""" Returns the Result of the assay, which holds its outcols and mean only. """
+		values = [self.pack['mode']] + list(self.pack['bounds']) + [self.pack['RM'],self.pack['SK'],self.pack['LOD']]
+		return Result([float(a) for a in values], float(self.pack['mean']), self.isempty, self.isfull)
+
+	def layout(self):
+		""" Returns the Layout shared by the assays with the same Vinoc, dilmin, dilfac and ntot as this one, or None if it does not use one. """
+		if not self.uselayout:
+			return None
+		return layout(self.pack['Vinoc'], self.pack['dilmin'], self.pack['dilfac'], self.pack['ntot'], self.tol)
+
+	@timing.timed('lCmode')
 	def lCmode(self):
-		""" Computes the mode of the posterior PDF for lCvir, and the TCID50 via the Reed-Munch and Spearmann-Kaerber estimation methods. """
+		""" Computes the mode of the posterior PDF for lCvir using Newton's method on the analytic derivatives of lnlike, within the bracket given by its layout if it uses one, and stores the # of iterations it took as niter. """
 		if 'mode' in self.pack.keys():
 			return self.pack['mode']
 		# If no infected well: give lC upper bound
@@ -139,54 +518,75 @@ class Assay(object):
 			self.pack['mode'] = numpy.nan
 			return self.pack['mode']
 		# Estimate most likely lCvir value (mode of dist)
-		bracket = -numpy.log10((self.VDs[0]*10.0, self.VDs[numpy.where(self.nmks)][0], self.VDs[-1]/10.0))
-		res = scipy.optimize.minimize_scalar(lambda x: -self.lCcalc(x), bracket=bracket)
-		assert res.success, 'Could not find lC mode'
-		self.pack['mode'] = res.x
+		layout = self.layout()
+		bracket = None if layout is None else layout.bracket(self.pack['ninf'])
+		if bracket is not None:
+			bracket = ([bracket[0]],[bracket[1]])
+		mode, niter = _newton_mode(self.VDs[None,:], self.pack['ntot'][None,:], self.pack['ninf'][None,:], bracket=bracket)
+		self.pack['mode'], self.pack['niter'] = mode[0], niter[0]
+		timing.count('newton_iterations', int(niter[0]))
 		return self.pack['mode']
 
+	def lnlike(self, lCvec):
+		""" Computes the log of the posterior likelihood computed by lCcalc for all elements in lCvec, evaluating every dilution against every element of lCvec in one (dilution x lCvec) array operation, and returns it with the same shape as lCvec. Unlike lCcalc, it does not underflow for large plates. """
+		lCvec = numpy.asarray(lCvec, dtype=float)
+		return lnlike(lCvec.ravel(), self.VDs, self.pack['ntot'], self.pack['ninf']).reshape(lCvec.shape)
+
 	def lCcalc(self, lCvec):
 		""" Compute posterior likelihood distribution, i.e. value of exp(lnProb), for all elements in vector lCvec, and returns it as a vector of the same size as lCvec, suitable for plotting. """
-		P = numpy.ones_like(lCvec)
-		for VD,n,k in zip(-self.VDs,self.pack['ntot'],self.pack['ninf']):
-			pinfvec = -numpy.expm1(10.0**lCvec*VD)
-			P *= scipy.stats.binom.pmf(k,n,pinfvec)
-		return P
+		return numpy.exp(self.lnlike(lCvec))
 
+	@timing.timed('lCdist')
 	def lCdist(self, lCvec=None):
-		""" Creates (if not provided) and stores the lCvir vector, stores the posterior PDF vector computed by lCcalc for the values in lCvir, and computes and stores the CDF vector corresponding to the PDF for the values in lCvir. """
+		""" Creates (if not provided, from the grid of its layout if it uses one, else adaptively, to within the precision tolerance) and stores the lCvir vector, stores the posterior PDF vector computed by lCcalc (divided by exp(lnpmax)) for the values in lCvir, and computes and stores the CDF vector corresponding to the PDF for the values in lCvir. """
+		lnpdf = None
 		if lCvec is None:
 			if self.isempty or self.isfull:
-				a = -numpy.log10(self.VDs[0])-10.0
-				b = -numpy.log10(self.VDs[-1])+10.0
-				lb = scipy.optimize.brentq(lambda x: self.lCcalc(x)-0.0001,a,b)
-				ub = scipy.optimize.brentq(lambda x: self.lCcalc(x)-0.9999,a,b)
+				lb, ub = self.lClod((0.0001,0.9999))
 				lCvec = numpy.linspace(lb,ub,500)
 			else:
-				lCvec = numpy.arange(0.0,1.0,0.01)
-				lCvec = numpy.hstack((lCvec-2,numpy.arange(-1.0,1.0,0.002),lCvec+1))
-				lCvec += self.lCmode()
+				mode = numpy.array([self.lCmode()])
+				width = 1.0/numpy.sqrt(-_lnlike_derivs(mode, self.VDs[None,:], self.pack['ntot'][None,:], self.pack['ninf'][None,:])[1])
+				layout = self.layout()
+				grid = None if layout is None else layout.lCdist(self.pack['ninf'], mode[0], width[0])
+				if grid is not None:
+					lCvec, lnpdf = grid
+				else:
+					lCvec, lnpdf = _adaptive_grid(lambda x: self.lnlike(x[0])[None,:], mode, width, self.tol)
+					lCvec, lnpdf = lCvec[0], lnpdf[0]
 		self.pack['lCvec'] = lCvec
-		# Compute posterior likelihood distribution (pdf) for lVec
-		self.pack['pdf'] = self.lCcalc(lCvec)
-		# Compute CDF from posterior likelihood dist
-		self.pack['cdf'] = numpy.cumsum(self.pack['pdf'][1:]*numpy.diff(self.pack['lCvec']))
+		# Compute posterior likelihood distribution (pdf) for lVec, scaled
+		# by exp(lnpmax) to avoid underflow (except for limit of detection)
+		if lnpdf is None:
+			lnpdf = self.lnlike(lCvec)
+		if self.isempty or self.isfull:
+			self.pack['lnpmax'] = 0.0
+		else:
+			self.pack['lnpmax'] = lnpdf.max()
+		self.pack['pdf'] = numpy.exp(lnpdf-self.pack['lnpmax'])
+		# Compute CDF from posterior likelihood dist (trapezoid rule)
+		self.pack['cdf'] = numpy.cumsum(0.5*(self.pack['pdf'][1:]+self.pack['pdf'][:-1])*numpy.diff(self.pack['lCvec']))
 		# Re-normalize so that CDF is 1 at Cvir= max in lCvec
 		self.pack['cdf'] = numpy.hstack((0.0,self.pack['cdf']))/self.pack['cdf'].max()
+		timing.count('grid_bytes', sum(numpy.asarray(self.pack[key]).nbytes for key in ('lCvec','pdf','cdf')))
+
+	def lClod(self, p=0.05):
+		""" Returns, for a limit of detection assay, the lCvir value above (no infected well) or below (all wells infected) which its likelihood is less than p times its maximum, i.e. its upper or lower detection limit, and nan for any other assay. For a sequence of p, returns the array of the values for each. """
+		ps = numpy.atleast_1d(p)
+		if not (self.isempty or self.isfull):
+			lC = numpy.full(len(ps), numpy.nan)
+		else:
+			lC = _lod_quantile(numpy.tile(self.VDs,(len(ps),1)), numpy.tile(self.pack['ntot'],(len(ps),1)), numpy.full(len(ps),self.isfull), ps)
+		return lC if numpy.ndim(p) else lC[0]
 
-	def lCbounds(self):
-		""" Computes and stores the 68% and 95% bounds of lCvir likelihood as a 4-element list: [68-lower,68-upper,95-lower, 95-upper]. """
+	@timing.timed('lCbounds')
+	def lCbounds(self, levels=(0.68,0.95)):
+		""" Computes and returns the highest posterior density bounds of lCvir likelihood for each credible level in levels as a list: by default, [68-lower,68-upper,95-lower, 95-upper]. """
 		if 'cdf' not in self.pack.keys():
 			self.lCdist()
 		if self.isempty or self.isfull:
-			return [numpy.nan]*4
-		ppf = scipy.interpolate.interp1d( self.pack['cdf'], self.pack['lCvec'], bounds_error=False, fill_value=0.0 )
-		subbounds = []
-		for frac in (0.68,0.95):
-			res = scipy.optimize.minimize_scalar(lambda x: ppf(x+frac)-ppf(x),bounds=(0.0,1.0-frac),method='bounded')
-			assert res.success, 'Could not find credible region.'
-			subbounds += list( ppf([res.x,res.x+frac]) )
-		return subbounds
+			return [numpy.nan]*2*len(levels)
+		return list( _hpd(self.pack['lCvec'][None,:], self.pack['pdf'][None,:], levels)[0] )
 
 	def payload(self):
 		# Compute Reed-Muench and Spearman-Kaerber
@@ -195,6 +595,142 @@ class Assay(object):
 		self.pack['bounds'] = self.lCbounds()
 		self.pack['dilutions'] = numpy.log10(self.VDs/self.pack['Vinoc'])
 		self.pack['mode'] = self.lCmode()
-		self.pack['mean'] = numpy.sum(self.pack['lCvec']*self.pack['pdf'])
-		self.pack['mean'] /= self.pack['pdf'].sum()
+		self.pack['LOD'] = self.lClod()
+		with timing.stage('mean'):
+			self.pack['mean'] = numpy.trapz(self.pack['lCvec']*self.pack['pdf'],self.pack['lCvec'])
+			self.pack['mean'] /= numpy.trapz(self.pack['pdf'],self.pack['lCvec'])
+		return self.pack
+
+
+class AssayBatch(object):
+	""" Computes the same results as Assay for many assays at once, as a stacked computation on (assay x grid) arrays. The inputs Vinoc, dilmin and dilfac can be scalars or one value per assay, and ninf and ntot are sequences of one list per assay, whose lengths can differ between assays (they are padded and masked). Assays are processed chunksize at a time to limit memory use. The results are stored in pack as one array per column of outcols, plus mean and niter (# of iterations to find the mode), and agree with those of Assay to within 1e-10 for mode, RM and SK, and to within the precision tier's error (see precisions) for mean and the credible bounds, since all the assays of a chunk share a common adaptive grid. """
+	def __init__(self, Vinoc, dilmin, dilfac, ninf, ntot, precision='standard', chunksize=256):
+		self.tol = precisions.get(precision, precision)
+		self.chunksize = chunksize
+		# Pad ninf and ntot to the largest # of dilutions with ninf=ntot=0,
+		# whose likelihood (binomial probability of 0 out of 0) is 1
+		self.ndils = numpy.array([len(a) for a in ntot])
+		nassays, ndils = len(self.ndils), self.ndils.max()
+		self.mask = numpy.arange(ndils) < self.ndils[:,None]
+		self.pack = {'ndils': self.ndils}
+		for key, val in (('ntot',ntot),('ninf',ninf)):
+			self.pack[key] = numpy.zeros((nassays,ndils),dtype=int)
+			self.pack[key][self.mask] = numpy.hstack([numpy.ravel(a) for a in val])
+		for key, val in (('Vinoc',Vinoc),('dilmin',dilmin),('dilfac',dilfac)):
+			self.pack[key] = numpy.broadcast_to(numpy.asarray(val,dtype=float),(nassays,))
+		self.nmks = self.pack['ntot']-self.pack['ninf']
+		# Flag lower and upper limits of detection
+		self.isempty = (self.pack['ninf'].sum(axis=1) == 0)
+		self.isfull = (self.nmks.sum(axis=1) == 0)
+		# Compute Vinoc * dilmin * dilfac^pow, set to 0 for padding
+		self.VDs = self.pack['Vinoc'] * self.pack['dilmin']
+		self.VDs = self.VDs[:,None] * self.pack['dilfac'][:,None]**numpy.arange(ndils)
+		self.VDs = numpy.where(self.mask,self.VDs,0.0)
+		self.payload()
+
+	def __len__(self):
+		return len(self.ndils)
+
+	def lnlike(self, lCvec, rows=slice(None)):
+		""" Computes the log-likelihood for each row of the 2-D array lCvec, for the assays selected by rows (all by default). """
+		return lnlike(lCvec, self.VDs[rows], self.pack['ntot'][rows], self.pack['ninf'][rows])
+
+	def lClod(self, rows, p=0.05):
+		""" Returns the array of lCvir values where the likelihood of the limit of detection assays selected by rows is p (a scalar or one value per element of rows) times its maximum (see Assay.lClod). """
+		return _lod_quantile(self.VDs[rows], self.pack['ntot'][rows], self.isfull[rows], p)
+
+	def lClimits(self, rows):
+		""" Returns the (lb,ub) arrays of lCvir values where the likelihood of the limit of detection assays selected by rows is 0.0001 and 0.9999, the range of their lCvec. """
+		lb, ub = self.lClod(numpy.tile(rows,2), numpy.repeat((0.0001,0.9999),len(rows))).reshape(2,-1)
+		return lb, ub
+
+	def lCmode(self, rows):
+		""" Computes the mode of the posterior PDF for lCvir of the (non limit of detection) assays selected by rows, and stores the # of Newton iterations each took as niter. """
+		mode, self.pack['niter'][rows] = _newton_mode(self.VDs[rows], self.pack['ntot'][rows], self.pack['ninf'][rows])
+		return mode
+
+	def lCdist(self, rows):
+		""" Returns the lCvec, pdf and cdf 2-D arrays (one row per assay selected by rows) as computed by Assay.lCdist. The selected assays must either all or none be limit of detection assays. """
+		lod = self.isempty[rows] + self.isfull[rows]
+		if lod.all():
+			lb, ub = self.lClimits(rows)
+			lCvec = lb[:,None] + (ub-lb)[:,None]*numpy.linspace(0.0,1.0,500)
+			pdf = numpy.exp(self.lnlike(lCvec,rows))
+		else:
+			mode = self.pack['mode'][rows]
+			width = 1.0/numpy.sqrt(-_lnlike_derivs(mode, self.VDs[rows], self.pack['ntot'][rows], self.pack['ninf'][rows])[1])
+			lCvec, pdf = _adaptive_grid(lambda x: self.lnlike(x,rows), mode, width, self.tol)
+			pdf = numpy.exp(pdf-pdf.max(axis=1)[:,None])
+		cdf = numpy.cumsum(0.5*(pdf[:,1:]+pdf[:,:-1])*numpy.diff(lCvec,axis=1),axis=1)
+		cdf = numpy.hstack((numpy.zeros((len(cdf),1)),cdf))/cdf[:,-1:]
+		return lCvec, pdf, cdf
+
+	def payload(self):
+		nassays = len(self)
+		# Compute Reed-Muench and Spearman-Kaerber
+		dilut = numpy.log10(numpy.where(self.mask,self.VDs,1.0))
+		self.pack['RM'], self.pack['SK'] = _RMSK(dilut,self.pack['ninf'],self.pack['ntot'],self.ndils)
+		# Limit of detection assays have no mode nor bounds, only a mean and
+		# detection limit
+		lod = self.isempty + self.isfull
+		for key in ['mode','mean','LOD']+outcols[1:5]:
+			self.pack[key] = numpy.full(nassays,numpy.nan)
+		self.pack['niter'] = numpy.zeros(nassays,dtype=int)
+		for sel in (numpy.where(~lod)[0],numpy.where(lod)[0]):
+			for rows in numpy.array_split(sel,numpy.arange(self.chunksize,len(sel),self.chunksize)):
+				if len(rows) == 0:
+					continue
+				if lod[rows[0]]:
+					self.pack['LOD'][rows] = self.lClod(rows)
+				else:
+					self.pack['mode'][rows] = self.lCmode(rows)
+				lCvec, pdf, cdf = self.lCdist(rows)
+				self.pack['mean'][rows] = numpy.trapz(lCvec*pdf,lCvec,axis=1)/numpy.trapz(pdf,lCvec,axis=1)
+				if not lod[rows[0]]:
+					bounds = _hpd(lCvec,pdf,(0.68,0.95))
+					for i,key in enumerate(outcols[1:5]):
+						self.pack[key][rows] = bounds[:,i]
+		return self.pack
+
+
+class PooledAssay(Assay):
+	""" The pooled posterior of replicate titrations of the same sample (e.g. on several plates), whose likelihood is the product of theirs. As for AssayBatch, Vinoc, dilmin and dilfac can be scalars or one value per replicate, and ninf and ntot are sequences of one list per replicate. The pooled likelihood is that of a single assay with the dilutions of all the replicates, such that it is computed in one (dilution x grid) array operation over the whole group, on one adaptive grid, rather than by analysing each replicate. Its pack holds the same results as that of an Assay, with RM and SK the mean of those of the replicates (nan if none has any), and nassays the # of replicates. It is a limit of detection assay only if none (isempty) or all (isfull) of the wells of its replicates are infected. """
+	__slots__ = ()
+
+	def __init__(self, Vinoc, dilmin, dilfac, ninf, ntot, precision='standard', timed=None, keep_grid=True):
+		ndils = numpy.array([len(a) for a in ntot])
+		assert [len(a) for a in ninf] == list(ndils), "Length of ninf != ntot."
+		nassays = len(ndils)
+		self.pack = {'nassays': nassays}
+		for key, val in (('Vinoc',Vinoc),('dilmin',dilmin),('dilfac',dilfac)):
+			self.pack[key] = numpy.broadcast_to(numpy.asarray(val,dtype=float),(nassays,))
+		self.tol = precisions.get(precision, precision)
+		self.uselayout = False
+		# Dilutions of all the replicates, one after the other
+		mask = numpy.arange(ndils.max()) < ndils[:,None]
+		VDs = (self.pack['Vinoc']*self.pack['dilmin'])[:,None] * self.pack['dilfac'][:,None]**numpy.arange(mask.shape[1])
+		self.VDs = VDs[mask]
+		self.pack['ntot'] = numpy.hstack([numpy.ravel(a) for a in ntot]).astype(int)
+		self.pack['ninf'] = numpy.hstack([numpy.ravel(a) for a in ninf]).astype(int)
+		self.nmks = self.pack['ntot']-self.pack['ninf']
+		self.isempty = bool(self.pack['ninf'].sum() == 0)
+		self.isfull = bool(self.nmks.sum() == 0)
+		# Reed-Muench and Spearman-Kaerber of each replicate, padded and masked
+		Npos, Ntot = numpy.zeros(mask.shape,dtype=int), numpy.zeros(mask.shape,dtype=int)
+		Npos[mask], Ntot[mask] = self.pack['ninf'], self.pack['ntot']
+		for key, val in zip(('RM','SK'),_RMSK(numpy.log10(numpy.where(mask,VDs,1.0)),Npos,Ntot,ndils)):
+			val = val[numpy.isfinite(val)]
+			self.pack[key] = val.mean() if len(val) else numpy.nan
+		self.timings = timing.Timings() if (timing.enabled if timed is None else timed) else None
+		with timing.recording(self.timings):
+			self.payload()
+		self.keep_grid(keep_grid)
+
+	def payload(self):
+		self.pack['bounds'] = self.lCbounds()
+		self.pack['mode'] = self.lCmode()
+		self.pack['LOD'] = self.lClod()
+		with timing.stage('mean'):
+			self.pack['mean'] = numpy.trapz(self.pack['lCvec']*self.pack['pdf'],self.pack['lCvec'])
+			self.pack['mean'] /= numpy.trapz(self.pack['pdf'],self.pack['lCvec'])
 		return self.pack
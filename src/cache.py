@@ -0,0 +1,180 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the cache of midsin.Assay results, keyed on a hash
+of the assay inputs (Vinoc, dilmin, dilfac, ninf, ntot), so that assays
+sharing the exact same inputs are only computed once. Results are kept in
+a bounded in-process LRU and, optionally, in an sqlite file which can be
+shared by the midsin command-line tool and the django web interface. The
+sqlite file is bounded too, the least recently used results being evicted,
+and holds the results without their posterior grids, which midsin.Assay
+computes again when they are needed.
+
+The cache is configured from the MIDSIN_CACHE_SIZE (# of results kept in
+memory, 0 to disable), MIDSIN_CACHE_PATH (sqlite file) and
+MIDSIN_CACHE_DISK_SIZE (# of results kept in the sqlite file, 0 for no
+limit) environment variables, or via configure().
+
+This file is part of the midsin module.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+
+# Bump whenever the results computed by midsin.Assay change
+VERSION = 5
+
+# Posterior grids of the results (see midsin.grids), not kept on disk
+grids = ('lCvec','pdf','cdf')
+
+
+def key(Vinoc, dilmin, dilfac, ninf, ntot, **options):
+	"""Computes the canonical hash of an assay's inputs.
+
+	Args:
+		Vinoc, dilmin, dilfac, ninf, ntot: The inputs of midsin.Assay.
+		options: Any other keyword argument which affects the results.
+
+	Returns:
+		key: Hexadecimal sha256 digest of the inputs.
+
+	"""
+	canon = [VERSION, float(Vinoc).hex(), float(dilmin).hex(), float(dilfac).hex()]
+	canon += [[int(a) for a in ninf], [int(a) for a in ntot]]
+	canon += sorted(options.items())
+	return hashlib.sha256(repr(canon).encode()).hexdigest()
+
+
+
+class ResultCache(object):
+	def __init__(self, maxsize=256, path=None, disksize=100000):
+		self.maxsize = maxsize
+		self.path = path
+		self.disksize = disksize
+		self.lru = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self._db = None
+		self._pid = None
+
+	def db(self):
+		""" Returns the connection to the sqlite file, (re-)opened if this is a new (e.g. forked) process. """
+		if self.path is None:
+			return None
+		if self._pid != os.getpid():
+			import sqlite3
+			self._db = sqlite3.connect(self.path, timeout=60.0, check_same_thread=False)
+			# Files written before results had an access time are started over
+			columns = [row[1] for row in self._db.execute('PRAGMA table_info(results)')]
+			if columns and 'atime' not in columns:
+				self._db.execute('DROP TABLE results')
+			self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, pack BLOB, atime REAL)')
+			self._db.execute('CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+			self._db.commit()
+			self._pid = os.getpid()
+		return self._db
+
+	def get(self, key):
+		""" Returns a (shallow) copy of the pack stored under key, or None if it is not cached. """
+		with self.lock:
+			if key in self.lru:
+				self.lru.move_to_end(key)
+				self.hits += 1
+				return dict(self.lru[key])
+			db = self.db()
+			row = None if db is None else db.execute('SELECT pack FROM results WHERE key=?', (key,)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			self.disk_hits += 1
+			db.execute('UPDATE results SET atime=? WHERE key=?', (time.time(), key))
+			db.commit()
+			pack = pickle.loads(row[0])
+			self._remember(key, pack)
+			return dict(pack)
+
+	def put(self, key, pack):
+		""" Stores a (shallow) copy of pack under key, in memory and, without its grids, on disk, where the least recently used results beyond disksize are evicted. """
+		with self.lock:
+			self._remember(key, dict(pack))
+			db = self.db()
+			if db is not None:
+				ondisk = {k: v for k, v in pack.items() if k not in grids}
+				db.execute('INSERT OR REPLACE INTO results VALUES (?,?,?)', (key, pickle.dumps(ondisk), time.time()))
+				if self.disksize > 0:
+					excess = db.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.disksize
+					if excess > 0:
+						db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY atime LIMIT ?)', (excess,))
+				db.commit()
+
+	def _remember(self, key, pack):
+		if self.maxsize <= 0:
+			return
+		self.lru[key] = pack
+		self.lru.move_to_end(key)
+		while len(self.lru) > self.maxsize:
+			self.lru.popitem(last=False)
+
+	def clear(self):
+		""" Empties the cache, in memory and on disk, and resets its counters. """
+		with self.lock:
+			self.lru.clear()
+			db = self.db()
+			if db is not None:
+				db.execute('DELETE FROM results')
+				db.commit()
+			self.hits = self.disk_hits = self.misses = 0
+
+	def stats(self):
+		""" Returns the cache counters as a dict. """
+		return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'size': len(self.lru), 'maxsize': self.maxsize, 'path': self.path, 'disksize': self.disksize}
+
+
+
+def configure(maxsize=None, path=None, disksize=None):
+	"""Replaces the cache used by midsin.Assay.
+
+	Args:
+		maxsize: # of results kept in memory (0 to disable), unchanged if None.
+		path: sqlite file of the persistent cache, unchanged if None.
+		disksize: # of results kept in the sqlite file (0 for no limit),
+			unchanged if None.
+
+	Returns:
+		results: The new midsin.cache.ResultCache.
+
+	"""
+	global results
+	if maxsize is None:
+		maxsize = results.maxsize
+	if path is None:
+		path = results.path
+	if disksize is None:
+		disksize = results.disksize
+	results = ResultCache(maxsize, path, disksize)
+	return results
+
+
+results = ResultCache(int(os.environ.get('MIDSIN_CACHE_SIZE', 256)), os.environ.get('MIDSIN_CACHE_PATH'), int(os.environ.get('MIDSIN_CACHE_DISK_SIZE', 100000)))
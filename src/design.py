@@ -0,0 +1,160 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the design of endpoint dilution assays: it ranks
+candidate plate layouts (Vinoc, dilmin, dilfac, ndils, nreps) which fit
+within a budget of wells by the expected width of their 95% credible
+interval, for samples whose log10(SIN/mL) is only known to lie within a
+prior range.
+
+The expected width of a layout is estimated by Monte Carlo: true log10
+SIN/mL values are drawn uniformly over the prior range (the same ones for
+every layout, so that they are compared on the same samples), the plate
+outcomes are drawn and analysed by midsin.simulate, each distinct outcome
+once. The interval of an outcome is clipped to the prior range, and a
+limit of detection outcome (no or all wells infected) is given the whole
+prior range. The layouts are split into
+chunks of samples which are analysed by a pool of processes.
+
+	ranked = midsin.design.rank((4.0,9.0), budget=96, jobs=4)
+	print(midsin.design.summary(ranked[:5]))
+
+This file is part of the midsin module.
+"""
+
+import itertools
+import numpy
+import midsin
+import midsin.simulate
+
+
+# Candidate dilmin, dilfac and nreps of the layouts ranked by default
+dilmins = (1.0, 0.1, 0.01, 0.001)
+dilfacs = (0.5, 0.25, 0.1)
+nrepss = (4, 6, 8, 12)
+
+# Statistics of each layout, summed over the chunks of its samples
+_sums = ('width68', 'width95', 'width95sq', 'lod')
+
+
+
+def candidates(budget, Vinoc=0.1, dilmin=dilmins, dilfac=dilfacs, nreps=nrepss, ndils=None, maxdils=24):
+	"""Enumerates the layouts which fit within a budget of wells.
+
+	Args:
+		budget: Largest # of wells (ndils*nreps) of a layout.
+		Vinoc: Volume of inoculum per well (in mL).
+		dilmin, dilfac, nreps: Sequences of the candidate values of each.
+		ndils: Sequence of the candidate # of dilutions, or None for the
+			largest which fits within budget (and maxdils), since more wells
+			can only narrow the expected credible interval.
+		maxdils: Largest # of dilutions of a layout.
+
+	Returns:
+		layouts: List of dicts of Vinoc, dilmin, dilfac, ndils and nreps.
+
+	"""
+	layouts = []
+	for dm, df, nr in itertools.product(dilmin, dilfac, nreps):
+		for nd in ([min(budget//nr, maxdils)] if ndils is None else ndils):
+			if 0 < nd <= maxdils and nd*nr <= budget:
+				layouts.append( {'Vinoc': Vinoc, 'dilmin': dm, 'dilfac': df, 'ndils': nd, 'nreps': nr} )
+	return layouts
+
+
+
+def _evaluate(layout, lCs, prior, seed, precision):
+	# Sums of the statistics of the credible intervals of the layout for one
+	# outcome drawn at each true lCvir value of lCs
+	ntot = [layout['nreps']]*layout['ndils']
+	ninf = midsin.simulate.draw(lCs, layout['Vinoc'], layout['dilmin'], layout['dilfac'], ntot, seed)
+	pack = midsin.simulate.analyse(layout['Vinoc'], layout['dilmin'], layout['dilfac'], ninf, ntot, precision)
+	widths = {}
+	for level in ('68','95'):
+		lb = numpy.clip(pack[level+'lb'], *prior)
+		ub = numpy.clip(pack[level+'ub'], *prior)
+		widths[level] = numpy.where(pack['lod'], prior[1]-prior[0], ub-lb)
+	return {'width68': widths['68'].sum(), 'width95': widths['95'].sum(), 'width95sq': (widths['95']**2).sum(), 'lod': pack['lod'].sum()}
+
+
+
+def rank(prior, budget=96, layouts=None, nsamples=2000, precision='fast', jobs=1, chunksize=1000, seed=0):
+	"""Ranks candidate layouts by the expected width of their 95% credible
+		interval for samples within a prior range.
+
+	Args:
+		prior: The (lower, upper) bounds of the log10(SIN/mL) of the samples.
+		budget: Largest # of wells of a layout, for the default layouts.
+		layouts: List of dicts of Vinoc, dilmin, dilfac, ndils and nreps, by
+			default candidates(budget).
+		nsamples: # of samples (true log10 SIN/mL and outcome) per layout.
+		precision: Precision tier of the credible intervals (see
+			midsin.precisions), fast being precise enough for their widths.
+		jobs: Number of processes among which the chunks are distributed.
+		chunksize: # of samples of a layout analysed at a time.
+		seed: Seed of the random samples, which do not depend on jobs.
+
+	Returns:
+		ranked: List of the layouts, narrowest expected 95% interval first,
+			each dict with the added nwells (# of wells), width95 and width68
+			(expected width of the 95% and 68% credible intervals), se95 (the
+			standard error of width95) and lod (fraction of limit of
+			detection outcomes).
+
+	"""
+	if layouts is None:
+		layouts = candidates(budget)
+	prior = (float(min(prior)), float(max(prior)))
+	seeds = numpy.random.SeedSequence(seed)
+	lCs = numpy.random.default_rng(seeds.spawn(1)[0]).uniform(prior[0], prior[1], nsamples)
+	chunks = [(i, lCs[start:start+chunksize]) for i in range(len(layouts)) for start in range(0, nsamples, chunksize)]
+	tasks = [(layouts[i], chunk, prior, child, precision) for (i, chunk), child in zip(chunks, seeds.spawn(len(chunks)))]
+	if jobs <= 1:
+		results = [_evaluate(*task) for task in tasks]
+	else:
+		import concurrent.futures
+		with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+			results = list(pool.map(_evaluate, *zip(*tasks)))
+	sums = [dict.fromkeys(_sums, 0.0) for layout in layouts]
+	for (i, chunk), result in zip(chunks, results):
+		for key in _sums:
+			sums[i][key] += result[key]
+	ranked = []
+	for layout, total in zip(layouts, sums):
+		width95 = total['width95']/nsamples
+		var95 = max(total['width95sq']/nsamples - width95**2, 0.0)
+		ranked.append( dict(layout, nwells=layout['ndils']*layout['nreps'], width95=width95, width68=total['width68']/nsamples, se95=numpy.sqrt(var95/nsamples), lod=total['lod']/nsamples) )
+	return sorted(ranked, key=lambda layout: layout['width95'])
+
+
+
+def summary(ranked):
+	"""Formats ranked layouts as a table.
+
+	Args:
+		ranked: List of layouts, as returned by rank.
+
+	Returns:
+		table: The layouts, one per line, as text.
+
+	"""
+	keys = ('dilmin','dilfac','ndils','nreps','nwells','width95','se95','width68','lod')
+	lines = ['%10s'*len(keys) % keys]
+	for layout in ranked:
+		lines.append( '%10g%10g%10d%10d%10d%10.4f%10.4f%10.4f%10.3f' % tuple(layout[key] for key in keys) )
+	return '\n'.join(lines)
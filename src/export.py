@@ -0,0 +1,166 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the binary export of the analysis of a batch of
+midsin.Assay, such that their results and posteriors can be used without
+analysing them again. A batch is saved as a directory of .npy files:
+- one array per column, with one element per assay: name (its label),
+  iline (its line # in the input csv file), the midsin.outcols, mean and
+  lnpmax (the log of the factor by which its pdf was divided);
+- the lCvec, pdf and cdf grids of all assays, concatenated into one array
+  each, the grids of the i-th assay being [offsets[i]:offsets[i+1]].
+The grids are written as the assays are added, so that exporting does not
+hold them in memory, and are memory-mapped when loaded, so that the
+posterior of one assay can be read without reading those of the others.
+
+	with midsin.export.Writer('run') as writer:
+		writer.add(idassay, 'sample1')
+	res = midsin.export.load('run')
+	lCvec, pdf, cdf = res.posterior(0)
+
+This file is part of the midsin module.
+"""
+
+import io
+import os
+import numpy
+import numpy.lib.format
+import midsin
+
+
+# Arrays of one element per assay, and concatenated grids of all assays
+columns = ['name','iline'] + midsin.outcols + ['mean','lnpmax']
+grids = midsin.grids
+
+
+
+class _Appender(object):
+	# A 1-D float64 .npy file to which arrays are appended as they come, its
+	# header being rewritten with the final length once closed
+	def __init__(self, path):
+		self.file = open(path, 'wb')
+		self.size = 0
+		self.header = self._header(2**62)
+		self.file.write(self.header)
+
+	def _header(self, size):
+		header = io.BytesIO()
+		numpy.lib.format.write_array_header_1_0(header, {'descr': '<f8', 'fortran_order': False, 'shape': (size,)})
+		return header.getvalue()
+
+	def append(self, values):
+		values = numpy.ascontiguousarray(values, dtype='<f8')
+		values.tofile(self.file)
+		self.size += values.size
+
+	def close(self):
+		header = self._header(self.size)
+		assert len(header) == len(self.header), 'Could not rewrite .npy header'
+		self.file.seek(0)
+		self.file.write(header)
+		self.file.close()
+
+
+
+class Writer(object):
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(path, exist_ok=True)
+		self.columns = {key: [] for key in columns}
+		self.offsets = [0]
+		self.grids = {key: _Appender(os.path.join(path, key+'.npy')) for key in grids}
+
+	def add(self, idassay, name='', iline=-1):
+		""" Adds the results and posterior grids of the midsin.Assay idassay, labelled name and read from line iline of the input. """
+		pack = idassay.pack
+		values = dict(zip(midsin.outcols, [pack['mode']]+list(pack['bounds'])+[pack['RM'],pack['SK'],pack['LOD']]))
+		values.update(name=name, iline=iline, mean=pack['mean'], lnpmax=pack['lnpmax'])
+		for key in columns:
+			self.columns[key].append( values[key] )
+		for key in grids:
+			self.grids[key].append( pack[key] )
+		self.offsets.append( self.offsets[-1] + len(pack['lCvec']) )
+
+	def close(self):
+		""" Writes the columns and offsets, and completes the grid files. """
+		for key in grids:
+			self.grids[key].close()
+		numpy.save(os.path.join(self.path, 'offsets.npy'), numpy.array(self.offsets, dtype=numpy.int64))
+		for key in columns:
+			if key == 'name':
+				values = numpy.array(self.columns[key], dtype=str)
+			elif key == 'iline':
+				values = numpy.array(self.columns[key], dtype=numpy.int64)
+			else:
+				values = numpy.array(self.columns[key], dtype=float)
+			numpy.save(os.path.join(self.path, key+'.npy'), values)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+
+class Results(object):
+	def __init__(self, path, mmap_mode='r'):
+		self.path = path
+		self.offsets = numpy.load(os.path.join(path, 'offsets.npy'))
+		self.columns = {key: numpy.load(os.path.join(path, key+'.npy')) for key in columns}
+		self.grids = {key: numpy.load(os.path.join(path, key+'.npy'), mmap_mode=mmap_mode) for key in grids}
+
+	def __len__(self):
+		return len(self.offsets)-1
+
+	def __getitem__(self, key):
+		""" Returns the array of column key (see midsin.export.columns), or the concatenated grid key (lCvec, pdf or cdf). """
+		if key in self.grids:
+			return self.grids[key]
+		return self.columns[key]
+
+	def index(self, name):
+		""" Returns the index of the first assay labelled name. """
+		idx = numpy.flatnonzero(self.columns['name'] == name)
+		if len(idx) == 0:
+			raise KeyError(name)
+		return int(idx[0])
+
+	def posterior(self, i):
+		""" Returns the lCvec, pdf and cdf arrays of the i-th assay (or of the first labelled i, if a str), as views of the memory-mapped grids. """
+		if isinstance(i, str):
+			i = self.index(i)
+		grid = slice(self.offsets[i], self.offsets[i+1])
+		return tuple(self.grids[key][grid] for key in grids)
+
+
+
+def load(path, mmap_mode='r'):
+	"""Opens the batch of results exported to directory path by Writer.
+
+	Args:
+		path: The directory of the exported batch.
+		mmap_mode: How the grids are memory-mapped (see numpy.load), or None
+			to read them into memory.
+
+	Returns:
+		results: midsin.export.Results, whose columns are accessed as
+			results['mode'], etc. and posterior grids as results.posterior(i).
+
+	"""
+	return Results(path, mmap_mode)
@@ -23,8 +23,14 @@ relative infectious virus concentration.
 This file is part of the midsin module.
 """
 
+import copy
 import numpy
 import matplotlib
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvas
+import matplotlib.ticker
+
+# rcParams of midSIN figures, only in effect while they are drawn or saved
 params = {
 	'xtick.labelsize': 14.0,
 	'xtick.direction': 'in',
@@ -37,50 +43,98 @@ params = {
 	'legend.fontsize': 'medium',
 	'font.family': 'serif',
 	'font.size': 14.0,
-	'text.usetex': True
+	'mathtext.fontset': 'cm',
+	'text.usetex': False
 }
-matplotlib.rcParams.update(params)
-import matplotlib.figure
-from matplotlib.backends.backend_agg import FigureCanvas
-import matplotlib.ticker
+
+# Whether text is typeset by LaTeX (requires a TeX install and is much
+# slower) rather than by matplotlib's mathtext, unless specified per figure
+usetex = False
 
 
 class grid_plot(object):
-	def __init__(self, ghgw, hspace=0.44, wspace=0.32, rwidth=3.8, rheight=3.6):
+	def __init__(self, ghgw, hspace=0.44, wspace=0.32, rwidth=3.8, rheight=3.6, usetex=None):
 		self.gh = ghgw[0]
 		self.gw = ghgw[1]
+		self.rc = dict(params, **{'text.usetex': globals()['usetex'] if usetex is None else usetex})
 		# Setup the figure looking nice
-		self.fig = matplotlib.figure.Figure(figsize=(rwidth*self.gw,rheight*self.gh),subplotpars=matplotlib.figure.SubplotParams(hspace=hspace,wspace=wspace))
-		self.canvas = FigureCanvas(self.fig)
+		with self.style():
+			self.fig = matplotlib.figure.Figure(figsize=(rwidth*self.gw,rheight*self.gh),subplotpars=matplotlib.figure.SubplotParams(hspace=hspace,wspace=wspace))
+			self.canvas = FigureCanvas(self.fig)
+
+	def style(self):
+		""" Returns the context in which the figure must be drawn and saved. """
+		return matplotlib.rc_context(self.rc)
 
 	def subaxes(self, idx, *args, **kwargs):
-		return self.fig.add_subplot(self.gh,self.gw,idx+1)
+		with self.style():
+			return self.fig.add_subplot(self.gh,self.gw,idx+1)
+
+	def savefig(self, *args, **kwargs):
+		""" Saves the figure, see matplotlib.figure.Figure.savefig. """
+		with self.style():
+			return self.fig.savefig(*args, **kwargs)
+
+
+
+def assay_grid(assays, labels, perpage=None, usetex=None):
+	""" Plots the posterior and observed wells of each assay, two assays per row, on a grid with room for perpage (default: all) assays. """
+	nrows = len(assays)+1 if perpage is None else (perpage+1)//2
+	gridfig = grid_plot((nrows,4), usetex=usetex)
+	pid = -1
+	with gridfig.style():
+		for idassay,label in zip(assays,labels):
+			pid += 1; ax = gridfig.subaxes(pid)
+			lC_post(idassay, ax)
+			ax.text(0.03,0.95,label,va='top',ha='left',transform=ax.transAxes)
+			pid += 1; ax = gridfig.subaxes(pid)
+			observed_wells(idassay, ax)
+	return gridfig
+
+
+
+def assay_panel(idassay, panel, usetex=None):
+	""" Plots either the posterior ('lC_post') or observed wells ('observed_wells') of an assay, alone on a figure. """
+	gridfig = grid_plot((1,1), usetex=usetex)
+	with gridfig.style():
+		ax = gridfig.subaxes(0)
+		{'lC_post': lC_post, 'observed_wells': observed_wells}[panel](idassay, ax)
+	return gridfig
 
 
 
 def lC_post(idassay, ax):
+	# Assays created with keep_grid=False have their grids computed again,
+	# on a copy so that they remain compact
+	if 'pdf' not in idassay.pack:
+		idassay = copy.copy(idassay)
+		idassay.pack = dict(idassay.pack)
+		idassay.lCdist()
 	xlab = r'$\log_{10}(\mathrm{specific\ infection, \mathrm{SIN/mL}})$'
 	if idassay.isempty or idassay.isfull:
 		ax.plot(idassay.pack['lCvec'],idassay.pack['pdf'],'k-')
 		ax.fill_between(idassay.pack['lCvec'],idassay.pack['pdf'],color=(0.5,0.5,0.5))
-		ax.set_title(r'Limit of detection')
+		ax.axvline(idassay.pack['LOD'], color='tab:blue')
+		ax.set_title(r'Limit of detection: $%s%.2f$' % ('<' if idassay.isempty else '>', idassay.pack['LOD']))
 		ax.set_xlabel(xlab)
 		ax.set_ylabel(r'Un-normalizable likelihood')
 		return True
 	# Truncate the plot's range and dist to 1e-3 its max
-	pmax = 10.**(round(numpy.log10(idassay.pack['pdf'].max())-0.5))
+	lscale = idassay.pack['lnpmax']/numpy.log(10.)
+	ppow = round(lscale+numpy.log10(idassay.pack['pdf'].max())-0.5)
+	pdf = idassay.pack['pdf']*10.**(lscale-ppow)
 	bound = idassay.pack['bounds']
 	# Outer dist
-	oidx = (idassay.pack['pdf'] > idassay.pack['pdf'].max()/1.0e3)
-	ax.fill_between(idassay.pack['lCvec'][oidx],idassay.pack['pdf'][oidx]/pmax,color=(0.5,0.5,0.5))
+	oidx = (pdf > pdf.max()/1.0e3)
+	ax.fill_between(idassay.pack['lCvec'][oidx],pdf[oidx],color=(0.5,0.5,0.5))
 	# 95% CR dist
 	idx = (bound[2] < idassay.pack['lCvec']) * (idassay.pack['lCvec'] < bound[3])
-	ax.fill_between(idassay.pack['lCvec'][idx],idassay.pack['pdf'][idx]/pmax,color=(0.75,0.75,0.75))
+	ax.fill_between(idassay.pack['lCvec'][idx],pdf[idx],color=(0.75,0.75,0.75))
 	# 68% CR dist
 	idx = (bound[0] < idassay.pack['lCvec']) * (idassay.pack['lCvec'] < bound[1])
-	ax.fill_between(idassay.pack['lCvec'][idx],idassay.pack['pdf'][idx]/pmax,color='white')
+	ax.fill_between(idassay.pack['lCvec'][idx],pdf[idx],color='white')
 	# The PDF outline
-	ax.plot(idassay.pack['lCvec'][oidx],idassay.pack['pdf'][oidx]/pmax,'k-')
+	ax.plot(idassay.pack['lCvec'][oidx],pdf[oidx],'k-')
 	# Indicated mode
 	ax.axvline(idassay.pack['mode'], color='tab:blue')
 	xlim = ax.get_xlim()
@@ -91,7 +145,7 @@ def lC_post(idassay, ax):
 	val = tuple([idassay.pack['mode']]+[a-idassay.pack['mode'] for a in bound])
 	ax.set_title(r'${%.3f\,}_{%+.2f}^{%+.2f}\left[{}_{%+.2f}^{%+.2f}\right]$'%val)
 	ax.set_xlabel(xlab)
-	ax.set_ylabel(r'$\propto$ Likelihood\ $(\times10^{%g})$'% numpy.log10(pmax))
+	ax.set_ylabel(r'$\propto$ Likelihood $(\times10^{%g})$'% ppow)
 	ax.set_xlim(xlim)
 
 
@@ -125,6 +179,6 @@ def observed_wells(idassay, ax):
 	ax.yaxis.set_major_locator(matplotlib.ticker.MaxNLocator(integer=True,min_n_ticks=min(6,idassay.pack['ntot'].max()),steps=[1, 2, 3, 4, 5, 10]))
 	ax.set_xlim(-DR[0][-1],-DR[0][0])
 	ax.set_ylim(-0.5,idassay.pack['ntot'].max()+0.5)
-	ax.set_xlabel(r'Sample dilution,\ $10^{-x}$')
+	ax.set_xlabel(r'Sample dilution, $10^{-x}$')
 	ax.set_ylabel('Number of infected wells')
 	ax.legend(['RM','SK'],bbox_to_anchor=(0.,1.02, 1.,.102), loc=3, ncol=2, borderaxespad=0., handlelength=1.7, handletextpad=0.3, frameon=False, borderpad=0.)
@@ -0,0 +1,181 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the simulation of endpoint dilution assays, and the
+calibration of midSIN's estimates on simulated plates. The # of infected
+wells of each dilution of a plate is drawn from the binomial distribution
+of midsin.Assay.lCcalc, each well being infected with probability
+1-exp(-C*Vinoc*D) for a sample of C SIN/mL at dilution D, for many plates
+at once as numpy arrays.
+
+coverage() draws plates for each of a set of true log10(SIN/mL) values, in
+chunks analysed by a pool of processes, each keeping only the sums of its
+statistics, such that millions of plates are analysed in constant memory.
+It reports the coverage of the 68% and 95% credible intervals, and the bias
+and root mean square error of the mode, mean, RM and SK.
+
+	results = midsin.simulate.coverage([5.0,7.0], nplates=100000, jobs=4)
+	print(midsin.simulate.summary(results))
+
+This file is part of the midsin module.
+"""
+
+import numpy
+import midsin
+
+
+# log10 SIN per TCID50 (from Wulff), to compare RM and SK to log10 SIN/mL,
+# as in midsin.plot
+wulff = numpy.log10(numpy.exp(-0.5772156649))
+
+# Statistics of each true lCvir value, summed over the chunks of its plates
+_sums = ('nplates','lod','cover68','cover95','nmode','mode','mode2','nmean','mean','mean2','nRM','RM','RM2','nSK','SK','SK2')
+
+
+
+def draw(lC, Vinoc, dilmin, dilfac, ntot, rng=None):
+	"""Draws the # of infected wells of simulated plates.
+
+	Args:
+		lC: Array of the true log10(SIN/mL) of the sample of each plate.
+		Vinoc, dilmin, dilfac, ntot: The layout of the plates, as the inputs
+			of midsin.Assay.
+		rng: numpy.random.Generator, or seed of a new one.
+
+	Returns:
+		ninf: Integer array of the # of infected wells of each plate (rows)
+			and dilution (columns).
+
+	"""
+	rng = numpy.random.default_rng(rng)
+	ntot = numpy.asarray(ntot)
+	VDs = Vinoc * dilmin * dilfac**numpy.arange(len(ntot))
+	return rng.binomial(ntot, -numpy.expm1(-10.0**numpy.asarray(lC,dtype=float)[...,None]*VDs))
+
+
+
+def analyse(Vinoc, dilmin, dilfac, ninf, ntot, precision='standard'):
+	"""Analyses simulated plates of the same layout, each distinct outcome
+		once, with midsin.AssayBatch.
+
+	Args:
+		Vinoc, dilmin, dilfac, ntot: The layout of the plates, as the inputs
+			of midsin.Assay.
+		ninf: Integer array of the # of infected wells of each plate (rows)
+			and dilution (columns), as drawn by draw.
+		precision: Precision tier of the analysis (see midsin.precisions).
+
+	Returns:
+		pack: Dict of arrays with one element per plate: the midsin.outcols,
+			mean, and lod (whether it is a limit of detection outcome).
+
+	"""
+	outcomes, inverse = numpy.unique(ninf, axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	batch = midsin.AssayBatch(Vinoc, dilmin, dilfac, outcomes, [list(ntot)]*len(outcomes), precision=precision)
+	pack = {key: batch.pack[key][inverse] for key in midsin.outcols+['mean']}
+	pack['lod'] = (batch.isempty + batch.isfull)[inverse]
+	return pack
+
+
+
+def _evaluate(lC, layout, nplates, seed, precision):
+	# Sums of the statistics of nplates plates drawn at the true lCvir value
+	ninf = draw(numpy.full(nplates,lC), layout['Vinoc'], layout['dilmin'], layout['dilfac'], layout['ntot'], seed)
+	pack = analyse(layout['Vinoc'], layout['dilmin'], layout['dilfac'], ninf, layout['ntot'], precision)
+	ok = ~pack['lod']
+	sums = {'nplates': nplates, 'lod': int(pack['lod'].sum())}
+	for level in ('68','95'):
+		sums['cover'+level] = int(numpy.sum((pack[level+'lb'][ok] <= lC) * (lC <= pack[level+'ub'][ok])))
+	for key, cor in (('mode',0.0),('mean',0.0),('RM',wulff),('SK',wulff)):
+		err = pack[key][ok]+cor-lC
+		err = err[numpy.isfinite(err)]
+		sums['n'+key] = len(err)
+		sums[key], sums[key+'2'] = err.sum(), (err**2).sum()
+	return sums
+
+
+
+def coverage(lCs, Vinoc=0.1, dilmin=0.01, dilfac=0.1, ntot=(8,)*11, nplates=10000, precision='standard', jobs=1, chunksize=5000, seed=0):
+	"""Calibrates midSIN's estimates on simulated plates of one layout.
+
+	Args:
+		lCs: Sequence of the true log10(SIN/mL) values at which plates are
+			drawn.
+		Vinoc, dilmin, dilfac, ntot: The layout of the plates, as the inputs
+			of midsin.Assay (by default, the 96-well plate of 11 10-fold
+			dilutions x 8 repeats).
+		nplates: # of plates drawn at each true value.
+		precision: Precision tier of the analysis (see midsin.precisions).
+		jobs: Number of processes among which the chunks are distributed.
+		chunksize: # of plates drawn and analysed at a time.
+		seed: Seed of the simulated plates, which do not depend on jobs.
+
+	Returns:
+		results: List of one dict per true value lC, with nplates, lod (the
+			fraction of limit of detection outcomes) and, over the other
+			outcomes, cover68 and cover95 (the fraction of credible intervals
+			which contain lC), and the bias and rmse (root mean square error)
+			of the mode, mean, RM and SK (converted to SIN/mL, as by wulff)
+			as e.g. mode_bias and RM_rmse.
+
+	"""
+	layout = {'Vinoc': Vinoc, 'dilmin': dilmin, 'dilfac': dilfac, 'ntot': list(ntot)}
+	chunks = [(i, float(lC), min(chunksize,nplates-start)) for i, lC in enumerate(lCs) for start in range(0, nplates, chunksize)]
+	tasks = [(lC, layout, n, child, precision) for (i, lC, n), child in zip(chunks, numpy.random.SeedSequence(seed).spawn(len(chunks)))]
+	sums = [dict.fromkeys(_sums, 0) for lC in lCs]
+	def add(results):
+		for (i, lC, n), result in zip(chunks, results):
+			for key in _sums:
+				sums[i][key] += result[key]
+	if jobs <= 1:
+		add(_evaluate(*task) for task in tasks)
+	else:
+		import concurrent.futures
+		with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+			add(pool.map(_evaluate, *zip(*tasks)))
+	out = []
+	for lC, total in zip(lCs, sums):
+		nok = total['nplates']-total['lod']
+		stats = {'lC': lC, 'nplates': total['nplates'], 'lod': total['lod']/total['nplates']}
+		for level in ('68','95'):
+			stats['cover'+level] = total['cover'+level]/nok if nok else numpy.nan
+		for key in ('mode','mean','RM','SK'):
+			n = total['n'+key]
+			stats[key+'_bias'] = total[key]/n if n else numpy.nan
+			stats[key+'_rmse'] = numpy.sqrt(total[key+'2']/n) if n else numpy.nan
+		out.append( stats )
+	return out
+
+
+
+def summary(results):
+	"""Formats the results of coverage as a table.
+
+	Args:
+		results: List of dicts, as returned by coverage.
+
+	Returns:
+		table: The results, one true value per line, as text.
+
+	"""
+	keys = ('lC','nplates','lod','cover68','cover95','mode_bias','mode_rmse','mean_bias','RM_bias','RM_rmse','SK_bias','SK_rmse')
+	lines = [('%6s%9s' + '%10s'*(len(keys)-2)) % keys]
+	for stats in results:
+		lines.append( ('%6.2f%9d' + '%10.4f'*(len(keys)-2)) % tuple(stats[key] for key in keys) )
+	return '\n'.join(lines)
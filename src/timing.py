@@ -0,0 +1,154 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the opt-in instrumentation of midsin, which records
+the wall time and # of calls of each stage of an analysis (cache, layout,
+RMSK, lCmode, lCdist, lnlike, lCbounds, mean, plot) along with counts of the
+work done: the # of likelihood evaluations (lnlike_points), of Newton
+iterations (newton_iterations) and the bytes of lCvir grid arrays stored
+(grid_bytes). Stages can be nested, the time of a stage excluding that of
+the stages within it, such that the times of all stages add up.
+
+Stages and counts are recorded into the Timings made current (in this
+thread) by recording(), and are ignored otherwise. A midsin.Assay created
+with timed=True, or while enabled is True, records its own Timings as its
+timings attribute.
+
+This file is part of the midsin module.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+
+
+# Whether each midsin.Assay records its timings, unless specified per assay
+enabled = False
+
+_local = threading.local()
+_null = contextlib.nullcontext()
+
+
+
+class Timings(object):
+	def __init__(self):
+		# name: [seconds, calls]
+		self.stages = {}
+		self.counts = {}
+		# [start, seconds spent in nested stages] of each stage entered
+		self._stack = []
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		""" Returns the context recording the time spent in it as stage name. """
+		self._stack.append([time.perf_counter(), 0.0])
+		try:
+			yield
+		finally:
+			start, nested = self._stack.pop()
+			elapsed = time.perf_counter() - start
+			if self._stack:
+				self._stack[-1][1] += elapsed
+			total = self.stages.setdefault(name, [0.0, 0])
+			total[0] += elapsed - nested
+			total[1] += 1
+
+	def count(self, name, n=1):
+		""" Adds n to the count name. """
+		self.counts[name] = self.counts.get(name, 0) + n
+
+	def add(self, other):
+		""" Adds the stage times, calls and counts of the Timings other to these. """
+		for name, (seconds, calls) in other.stages.items():
+			total = self.stages.setdefault(name, [0.0, 0])
+			total[0] += seconds
+			total[1] += calls
+		for name, n in other.counts.items():
+			self.count(name, n)
+
+	def as_dict(self):
+		""" Returns the stages as {name: {'seconds','calls'}} and counts as {name: n}, e.g. to be saved as JSON. """
+		stages = {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in self.stages.items()}
+		return {'stages': stages, 'counts': dict(self.counts)}
+
+	def summary(self, wall=None):
+		""" Returns a table of the time, share and # of calls of each stage (slowest first) followed by the counts, as text. If the wall time of the run is given, the time spent outside of any stage is shown as other. """
+		rows = sorted(self.stages.items(), key=lambda item: -item[1][0])
+		total = sum(seconds for seconds, calls in self.stages.values())
+		if wall is not None and wall > total:
+			rows.append( ('other', [wall-total, 0]) )
+			total = wall
+		lines = ['%-18s %12s %7s %10s' % ('stage','time (s)','%','calls')]
+		for name, (seconds, calls) in rows:
+			lines.append( '%-18s %12.6f %7.1f %10s' % (name, seconds, 100.0*seconds/total if total else 0.0, calls or '') )
+		lines.append( '%-18s %12.6f' % ('total', total) )
+		for name in sorted(self.counts):
+			lines.append( '%-18s %12d' % (name, self.counts[name]) )
+		return '\n'.join(lines)
+
+
+
+def current():
+	""" Returns the Timings being recorded into in this thread, or None. """
+	return getattr(_local, 'timings', None)
+
+
+
+@contextlib.contextmanager
+def recording(timings):
+	""" Returns the context in which stages and counts are recorded into timings, or which leaves the current Timings in place if timings is None. """
+	if timings is None:
+		yield None
+		return
+	previous = current()
+	_local.timings = timings
+	try:
+		yield timings
+	finally:
+		_local.timings = previous
+
+
+
+def stage(name):
+	""" Returns the context recording the time spent in it as stage name of the current Timings, if any. """
+	timings = current()
+	return _null if timings is None else timings.stage(name)
+
+
+
+def count(name, n=1):
+	""" Adds n to the count name of the current Timings, if any. """
+	timings = current()
+	if timings is not None:
+		timings.count(name, n)
+
+
+
+def timed(name):
+	""" Decorates a function such that each of its calls is recorded as stage name of the current Timings, if any. """
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			timings = current()
+			if timings is None:
+				return func(*args, **kwargs)
+			with timings.stage(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
@@ -17,10 +17,14 @@
 # =============================================================================
 
 import argparse
+import collections
 import csv
 import midsin
-import midsin.plot
+import midsin.cache
+import midsin.export
+import midsin.timing
 import io
+import os
 
 
 
@@ -34,7 +38,7 @@ def dict_to_output(pdic):
 
 	Returns:
 		gridfig: matplotlib figure grid which can be saved via method
-			gridfig.fig.savefig.
+			gridfig.savefig.
 		writer_file: io.StingIO of the input+output written using csv.writer
 
 	"""
@@ -77,16 +81,416 @@ def dict_to_csv(pdic,header=True):
 
 
 
-def csv_to_output(csv_input_lines):
+def parse_line(line):
+	"""Parses one csv.reader parsed input line into the arguments of
+		midsin.Assay.
+
+	Args:
+		line: csv.reader-style list of the fields of a sample outcome.
+
+	Returns:
+		Vinoc, dilmin, dilfac, ninf, ntot: The arguments of midsin.Assay.
+
+	"""
+	Vinoc,dilmin,dilfac = (float(a) for a in line[1:1+3])
+	icut = line[4:].index('#') + 4
+	ntot = [int(a) for a in line[4:icut]]
+	icut2 = line[icut+1:].index('#') + icut + 1
+	ninf = [int(a) for a in line[icut+1:icut2]]
+	assert len(ntot)==len(ninf), "Length of ninf != ntot."
+	assert max(ntot, default=0) <= midsin.maxwells, "Must have ntot <= %d." % midsin.maxwells
+	return Vinoc, dilmin, dilfac, ninf, ntot
+
+
+
+def row_key(line, precision='standard'):
+	"""Computes the hash of the inputs of a csv.reader parsed sample outcome
+		line (see midsin.cache.key), which identifies its results.
+
+	Args:
+		line: csv.reader-style list of the fields of a sample outcome, with
+			or without the output columns appended.
+		precision: Precision tier of the midsin.Assay (see midsin.precisions).
+
+	Returns:
+		key: Hexadecimal digest of the inputs, or None if line is a header,
+			commented-out (using #), empty or unparsable line.
+
+	"""
+	if (not line) or (midsin.label['Vinoc'] in line) or (line[0] == '#'):
+		return None
+	try:
+		Vinoc, dilmin, dilfac, ninf, ntot = parse_line(line)
+	except Exception:
+		return None
+	return midsin.cache.key(Vinoc, dilmin, dilfac, ninf, ntot, tol=midsin.precisions.get(precision, precision), uselayout=True)
+
+
+
+def _analyse(lines, precision, timed=None, keep_grid=True):
+	# Returns, for each line, the midsin.Assay of a sample outcome line, None
+	# for header, commented-out (using #) or empty lines or, should the
+	# analysis fail, the exception raised so the rest of the batch proceeds
+	results = []
+	for line in lines:
+		if (not line) or (midsin.label['Vinoc'] in line) or (line[0] == '#'):
+			results.append(None)
+			continue
+		try:
+			results.append( midsin.Assay(*parse_line(line), precision=precision, timed=timed, keep_grid=keep_grid) )
+		except Exception as e:
+			results.append(e)
+	return results
+
+
+
+def _chunks(iterable, size):
+	# Lazily groups the items of iterable into lists of (at most) size items
+	chunk = []
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+
+def iter_output(csv_input_lines, precision='standard', jobs=1, errors=None, chunksize=16, timings=None, previous=None, keep_grid=True):
+	"""Lazily parses a list or iterator of csv.reader parsed input lines into
+		midsin.Assay, yielding the analysis of each line as soon as it is
+		available (and in order), so that memory use does not grow with the
+		number of lines.
+
+	Args:
+		csv_input_lines: csv.reader-style interator or list of lines.
+		precision: Precision tier of the midsin.Assay (see midsin.precisions).
+		jobs: Number of processes among which the assays are distributed,
+			chunksize lines at a time with at most 2*jobs chunks in flight.
+		errors: List to which the (line #, exception) of lines which could
+			not be analysed are appended, their output columns being replaced
+			by the error message. If None, the exception is raised instead.
+		chunksize: Number of lines analysed at a time.
+		timings: midsin.timing.Timings to which the timings of each
+			midsin.Assay are added, the assays being timed if it is given.
+		previous: Dict of the output columns of sample outcomes from a
+			previous run, by row_key: lines found in it are not analysed
+			again, but yielded with these output columns (and idassay None).
+		keep_grid: Whether the midsin.Assay keep their posterior grids, as
+			needed to plot them, or as float32 if 'float32' (see midsin.Assay).
+			Without them, far less memory is used and, with jobs, sent back.
+
+	Yields:
+		line: The csv.writer-formatted output line, i.e. the input line with
+			the output columns (or their header) appended.
+		idassay: The midsin.Assay of the line, or None if it is a header,
+			commented-out (using #), empty, erroneous or previous line.
+
+	"""
+	if previous:
+		# Lines whose results are in previous are passed on as empty lines
+		originals = collections.deque()
+		def todo(lines):
+			for line in lines:
+				out = previous.get(row_key(line, precision))
+				originals.append( (line, out) )
+				yield line if out is None else []
+		csv_input_lines = todo(csv_input_lines)
+	iline = 0
+	timed = True if timings is not None else None
+	for lines, results in _analysed_chunks(csv_input_lines, precision, jobs, chunksize, timed, keep_grid):
+		for line, idassay in zip(lines, results):
+			iline += 1
+			out = None
+			if previous:
+				line, out = originals.popleft()
+			if out is not None:
+				yield line + list(out), None
+			# Check if this is the header line
+			elif line and midsin.label['Vinoc'] in line:
+				yield line + [midsin.label[key] for key in midsin.outcols], None
+			# Check if line is commented-out (using #) or empty
+			elif idassay is None:
+				yield line, None
+			elif isinstance(idassay, Exception):
+				if errors is None:
+					raise idassay
+				errors.append( (iline, idassay) )
+				yield line + ['error: %s'%idassay], None
+			else:
+				if timings is not None:
+					timings.add(idassay.timings)
+				out = [ idassay.pack['mode'] ] + idassay.pack['bounds']
+				out += [ idassay.pack['RM'] , idassay.pack['SK'] , idassay.pack['LOD'] ]
+				yield line + out, idassay
+
+
+
+def _analysed_chunks(csv_input_lines, precision, jobs, chunksize, timed=None, keep_grid=True):
+	# Yields (in order) each chunk of lines along with its analysis, keeping
+	# at most 2*jobs chunks in flight in the pool of processes
+	chunks = _chunks(csv_input_lines, chunksize)
+	if jobs <= 1:
+		for chunk in chunks:
+			yield chunk, _analyse(chunk, precision, timed, keep_grid)
+		return
+	import concurrent.futures
+	cache = midsin.cache.results
+	with concurrent.futures.ProcessPoolExecutor(jobs, initializer=midsin.cache.configure, initargs=(cache.maxsize,cache.path,cache.disksize)) as pool:
+		pending = collections.deque()
+		for chunk in chunks:
+			pending.append( (chunk, pool.submit(_analyse, chunk, precision, timed if timed is not None else midsin.timing.enabled, keep_grid)) )
+			if len(pending) >= 2*jobs:
+				chunk, future = pending.popleft()
+				yield chunk, future.result()
+		while pending:
+			chunk, future = pending.popleft()
+			yield chunk, future.result()
+
+
+
+def _group_key(line, group_by):
+	# The value of input column group_by (name or comments) of a sample outcome
+	if group_by == 'name':
+		return line[0]
+	icut = line[4:].index('#') + 4
+	icut2 = line[icut+1:].index('#') + icut + 1
+	return ' '.join(a for a in line[icut2+1:] if a.strip()).strip()
+
+
+
+def pool_output(csv_input_lines, group_by='name', precision='standard', errors=None, keep_grid=True):
+	"""Pools the sample outcomes of a list or iterator of csv.reader parsed
+		input lines which are replicate titrations of the same sample, i.e.
+		have the same value of column group_by, into one midsin.PooledAssay
+		per group. Only the inputs of each group are kept until all lines are
+		read, and each group is analysed once, in one pass over its
+		replicates, rather than replicate by replicate.
+
+	Args:
+		csv_input_lines: csv.reader-style interator or list of lines.
+		group_by: Input column identifying the sample, 'name' or 'comments'.
+		precision: Precision tier of the midsin.PooledAssay (see
+			midsin.precisions).
+		errors: List to which the (line #, exception) of lines which could
+			not be parsed, and of groups which could not be analysed (at the
+			line # of their first line), are appended, the output columns of
+			the latter being replaced by the error message. If None, the
+			exception is raised instead.
+		keep_grid: Whether the midsin.PooledAssay keep their posterior grids
+			(see midsin.Assay).
+
+	Yields:
+		line: The csv.writer-formatted output line, i.e. the group_by value
+			and # of sample outcomes pooled followed by the output columns,
+			the first line being their header.
+		idassay: The midsin.PooledAssay of the group, or None for the header
+			or an erroneous group.
+
+	"""
+	groups = collections.OrderedDict()
+	for iline, line in enumerate(csv_input_lines, 1):
+		if (not line) or (midsin.label['Vinoc'] in line) or (line[0] == '#'):
+			continue
+		try:
+			key = _group_key(line, group_by)
+			inputs = parse_line(line)
+		except Exception as e:
+			if errors is None:
+				raise
+			errors.append( (iline, e) )
+			continue
+		groups.setdefault(key, (iline, []))[1].append(inputs)
+	yield [midsin.label[group_by], midsin.label['nassays']] + [midsin.label[key] for key in midsin.outcols], None
+	for key, (iline, inputs) in groups.items():
+		try:
+			idassay = midsin.PooledAssay(*zip(*inputs), precision=precision, keep_grid=keep_grid)
+		except Exception as e:
+			if errors is None:
+				raise
+			errors.append( (iline, e) )
+			yield [key, len(inputs), 'error: %s'%e], None
+			continue
+		out = [ idassay.pack['mode'] ] + idassay.pack['bounds']
+		out += [ idassay.pack['RM'] , idassay.pack['SK'] , idassay.pack['LOD'] ]
+		yield [key, len(inputs)] + out, idassay
+
+
+
+def assays_to_gridfig(assays, labels):
+	"""Plots the analysis of each midsin.Assay and its label on a single
+		figure grid.
+
+	Args:
+		assays: List of midsin.Assay.
+		labels: List of the label of each assay.
+
+	Returns:
+		gridfig: matplotlib figure grid which can be saved via method
+			gridfig.savefig.
+
+	"""
+	import midsin.plot
+	with midsin.timing.stage('plot'):
+		return midsin.plot.assay_grid(assays, labels)
+
+
+
+def _pages(assays, perpage):
+	# Lazily groups the (midsin.Assay, label) into (assays, labels) pages,
+	# yielding one blank page if there are no assays
+	blank = True
+	for page in _chunks(assays, perpage):
+		blank = False
+		yield tuple(zip(*page))
+	if blank:
+		yield (), ()
+
+
+
+def _render_page(page):
+	# Renders one page of assays into its own png or svg file
+	import midsin.plot
+	assays, labels, perpage, usetex, path = page
+	with midsin.timing.stage('plot'):
+		gridfig = midsin.plot.assay_grid(assays, labels, perpage, usetex)
+		gridfig.savefig(path,bbox_inches='tight')
+	return path
+
+
+
+def render_pages(assays, out, fmt='pdf', perpage=10, jobs=1, usetex=None):
+	"""Plots the analysis of each midsin.Assay on fixed-size pages of perpage
+		assays, rendered one at a time so that memory use is bounded by the
+		page size rather than the number of assays.
+
+	Args:
+		assays: List or iterator of (midsin.Assay, label).
+		out: The multi-page pdf file (path or file object) if fmt is 'pdf',
+			otherwise the directory (created if needed) in which each page is
+			saved as page-001.fmt, page-002.fmt, etc.
+		fmt: Output format, one of 'pdf', 'png' or 'svg'.
+		perpage: Number of assays per page.
+		jobs: Number of processes among which the png or svg pages are
+			distributed, at most 2*jobs pages being in flight.
+		usetex: Whether text is typeset by LaTeX rather than by matplotlib's
+			mathtext (default: midsin.plot.usetex).
+
+	The rendering of each page is recorded as the plot stage of the current
+	midsin.timing.Timings, if any (only for the pages rendered in this
+	process).
+
+	Returns:
+		npages: Number of pages rendered (at least one, blank if no assays).
+
+	"""
+	import midsin.plot
+	if usetex is None:
+		usetex = midsin.plot.usetex
+	pages = _pages(assays, perpage)
+	if fmt == 'pdf':
+		from matplotlib.backends.backend_pdf import PdfPages
+		npages = 0
+		# without its creation date, the same pages give the same file
+		with PdfPages(out, metadata={'CreationDate': None}) as pdf:
+			for page in pages:
+				with midsin.timing.stage('plot'):
+					gridfig = midsin.plot.assay_grid(page[0], page[1], perpage, usetex)
+					with gridfig.style():
+						pdf.savefig(gridfig.fig,bbox_inches='tight')
+				npages += 1
+		return npages
+	os.makedirs(out, exist_ok=True)
+	pages = ( (page[0], page[1], perpage, usetex, os.path.join(out,'page-%03d.%s'%(n+1,fmt))) for n,page in enumerate(pages) )
+	if jobs <= 1:
+		return len([_render_page(page) for page in pages])
+	import concurrent.futures
+	npages = 0
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+		pending = collections.deque()
+		for page in pages:
+			pending.append( pool.submit(_render_page, page) )
+			if len(pending) >= 2*jobs:
+				pending.popleft().result()
+				npages += 1
+		while pending:
+			pending.popleft().result()
+			npages += 1
+	return npages
+
+
+
+def render_changed_pages(rows, out, fmt='pdf', perpage=10, usetex=None, previous=None, precision='standard'):
+	"""Incremental counterpart of render_pages, which saves each page of
+		perpage assays as its own file (whatever the format) and only
+		renders the pages whose sample outcomes or labels changed since a
+		previous run, so that the time taken scales with the number of
+		changed pages rather than of assays.
+
+	Args:
+		rows: List or iterator of (line, idassay) of each sample outcome,
+			idassay being its midsin.Assay or None, in which case it is only
+			analysed if its page must be rendered.
+		out: The directory (created if needed) in which each page is saved as
+			page-001.fmt, page-002.fmt, etc., those left beyond the last page
+			by a previous run being deleted.
+		fmt: Output format, one of 'pdf', 'png' or 'svg'.
+		perpage: Number of assays per page.
+		usetex: Whether text is typeset by LaTeX rather than by matplotlib's
+			mathtext (default: midsin.plot.usetex).
+		previous: List of the signatures of the pages of the previous run.
+		precision: Precision tier of the midsin.Assay analysed.
+
+	Returns:
+		signatures: List of the signature of each page, i.e. the hash of the
+			inputs and labels of its sample outcomes and of its format.
+
+	"""
+	import hashlib
+	import re
+	import midsin.plot
+	if usetex is None:
+		usetex = midsin.plot.usetex
+	previous = previous or []
+	os.makedirs(out, exist_ok=True)
+	signatures = []
+	for n, (lines, assays) in enumerate(_pages(rows, perpage)):
+		path = os.path.join(out, 'page-%03d.%s'%(n+1,fmt))
+		signature = [fmt, perpage, usetex] + [(row_key(line, precision), line[0]) for line in lines]
+		signatures.append( hashlib.sha256(repr(signature).encode()).hexdigest() )
+		if n < len(previous) and previous[n] == signatures[-1] and os.path.exists(path):
+			continue
+		assays = [midsin.Assay(*parse_line(line), precision=precision) if idassay is None else idassay for line, idassay in zip(lines, assays)]
+		_render_page( (assays, [line[0] for line in lines], perpage, usetex, path) )
+	for name in os.listdir(out):
+		page = re.fullmatch(r'page-(\d+)\.'+fmt, name)
+		if page and int(page.group(1)) > len(signatures):
+			os.remove(os.path.join(out, name))
+	return signatures
+
+
+
+def csv_to_output(csv_input_lines, precision='standard', jobs=1, errors=None, timings=None, export=None):
 	"""Parses a list or iterator of csv.reader parsed input lines into a
 		midsin.Assay and returns the analysis as a figure and csv StringIO.
 
 	Args:
 		csv_input_lines: csv.reader-style interator or list of lines.
+		precision: Precision tier of the midsin.Assay (see midsin.precisions).
+		jobs: Number of processes among which the assays are distributed.
+		errors: List to which the (line #, exception) of lines which could
+			not be analysed are appended, their output columns being replaced
+			by the error message. If None, the exception is raised instead.
+		timings: midsin.timing.Timings to which the timings of each
+			midsin.Assay and of the plot are added, the assays being timed if
+			it is given.
+		export: Directory where the results and posterior grids of the assays
+			are also saved, as memory-mappable arrays (see midsin.export).
 
 	Returns:
 		gridfig: matplotlib figure grid which can be saved via method
-			gridfig.fig.savefig.
+			gridfig.savefig.
 		writer_file: io.StingIO of the input+output written using csv.writer
 
 	"""
@@ -97,39 +501,19 @@ def csv_to_output(csv_input_lines):
 
 	labels = []
 	assays = []
-	for line in csv_input_lines:
-		# Check if this is the header line
-		if midsin.label['Vinoc'] in line:
-			line += [midsin.label[key] for key in midsin.outcols]
-			writer.writerow(line)
-			continue
-		# Check if line is commented-out (using #)
-		elif line[0] == '#':
-			writer.writerow(line)
-			continue
-		# Otherwise, parse input csv file line and input data into Assay
-		Vinoc,dilmin,dilfac = (float(a) for a in line[1:1+3])
-		icut = line[4:].index('#') + 4
-		ntot = [int(a) for a in line[4:icut]]
-		icut2 = line[icut+1:].index('#') + icut + 1
-		ninf = [int(a) for a in line[icut+1:icut2]]
-		assert len(ntot)==len(ninf)
-		labels.append( line[0] )
-		assays.append( midsin.Assay(Vinoc, dilmin, dilfac, ninf, ntot=ntot) )
-
-		# write results to file for output csv file
-		line += [ assays[-1].pack['mode'] ] + assays[-1].pack['bounds']
-		line += [ assays[-1].pack['RM'] , assays[-1].pack['SK'] ]
+	if export is not None:
+		exporter = midsin.export.Writer(export)
+	# the assays are kept without their grids, computed again when plotted
+	for iline, (line, idassay) in enumerate(iter_output(csv_input_lines, precision, jobs, errors, timings=timings, keep_grid=export is not None)):
 		writer.writerow(line)
+		if idassay is not None:
+			labels.append( line[0] )
+			assays.append( idassay )
+			if export is not None:
+				exporter.add(idassay, line[0], iline+1)
+	if export is not None:
+		exporter.close()
 
 	# plot results 
-	gridfig = midsin.plot.grid_plot((len(assays)+1,4))
-	pid = -1;
-	for idassay,label in zip(assays,labels):
-		pid += 1; ax = gridfig.subaxes(pid); 
-		midsin.plot.lC_post(idassay, ax)
-		ax.text(0.03,0.95,label,va='top',ha='left',transform=ax.transAxes) 
-		pid += 1; ax = gridfig.subaxes(pid)
-		midsin.plot.observed_wells(idassay, ax)
-
-	return gridfig, writer_file
+	with midsin.timing.recording(timings):
+		return assays_to_gridfig(assays, labels), writer_file
@@ -0,0 +1,42 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the django application of the web interface, which
+recovers the batch jobs left queued or interrupted by a restart of the
+server (see midsin.web.jobs.recover) as soon as the server handles its
+first request, rather than when it is ready, since the database may not be
+set up yet then (e.g. before migrate), and since the workers of the job
+pool set up django too.
+"""
+
+from django.apps import AppConfig
+from django.core.signals import request_started
+
+
+class WebConfig(AppConfig):
+	name = 'midsin.web'
+
+	def ready(self):
+		request_started.connect(_recover, dispatch_uid='midsin.web.recover')
+
+
+
+def _recover(**kwargs):
+	import midsin.web.jobs
+	request_started.disconnect(dispatch_uid='midsin.web.recover')
+	midsin.web.jobs.recover()
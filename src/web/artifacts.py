@@ -0,0 +1,100 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the store of result files (artifacts, e.g. the zip of
+a batch's results) of the web interface. Each artifact is saved on disk
+under the sha256 of its content, its ID, such that identical results are
+stored once and an ID always refers to the same content. Artifacts expire
+MIDSIN_ARTIFACT_TTL seconds after they were last stored, and the oldest
+ones are evicted once the store exceeds MIDSIN_ARTIFACT_MAX_BYTES.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+from django.conf import settings
+
+
+def _path(artid):
+	return os.path.join(settings.MIDSIN_ARTIFACT_PATH, artid[:2], artid)
+
+
+
+def put(data):
+	"""Stores an artifact, then evicts expired and excess artifacts.
+
+	Args:
+		data: The content (bytes) of the artifact.
+
+	Returns:
+		artid: The ID of the artifact, i.e. the hexadecimal sha256 of data.
+
+	"""
+	artid = hashlib.sha256(data).hexdigest()
+	path = _path(artid)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	if os.path.exists(path):
+		os.utime(path)
+	else:
+		# Written under a temporary name so it is never served incomplete
+		fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path))
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+		os.replace(tmppath, path)
+	prune()
+	return artid
+
+
+
+def path(artid):
+	""" Returns the path of the file of artifact artid, or None if it does not exist or has expired. """
+	if not re.fullmatch('[0-9a-f]{64}', artid):
+		return None
+	path = _path(artid)
+	try:
+		if os.path.getmtime(path) < time.time() - settings.MIDSIN_ARTIFACT_TTL:
+			return None
+	except FileNotFoundError:
+		return None
+	return path
+
+
+
+def prune():
+	""" Deletes the expired artifacts, then the oldest ones until the store is within MIDSIN_ARTIFACT_MAX_BYTES. """
+	expired = time.time() - settings.MIDSIN_ARTIFACT_TTL
+	artifacts = []
+	for root, dirs, files in os.walk(settings.MIDSIN_ARTIFACT_PATH):
+		for name in files:
+			try:
+				stat = os.stat(os.path.join(root, name))
+			except FileNotFoundError:
+				continue
+			artifacts.append( (stat.st_mtime, stat.st_size, os.path.join(root, name)) )
+	artifacts.sort()
+	total = sum(size for mtime,size,path in artifacts)
+	for mtime, size, path in artifacts:
+		if mtime >= expired and total <= settings.MIDSIN_ARTIFACT_MAX_BYTES:
+			break
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+		total -= size
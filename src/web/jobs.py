@@ -0,0 +1,251 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""
+This module contains the queue of batch jobs of the web interface. Each
+uploaded csv file is stored as a midsin.web.models.BatchJob, the database
+being the queue, and is analysed and rendered by a local pool of worker
+processes while the batch page polls its status, so that no external
+broker is needed. A job is claimed atomically by the worker which runs
+it, such that jobs left queued by a restarted server, or by a pool whose
+worker died, can simply be submitted again. Jobs left running past their
+time limit were interrupted, and are failed by recover(), which runs on
+the first request of the server (see midsin.web.apps) and whenever a job
+is submitted or its status polled.
+
+The queue is configured by the MIDSIN_JOB_* settings (see settings/base.py).
+"""
+
+import atexit
+import concurrent.futures
+import csv
+import datetime
+import io
+import threading
+import time
+import zipfile
+from django.conf import settings
+from django.utils import timezone
+import midsin
+import midsin.cache
+import midsin.plot
+import midsin.utils
+import midsin.web.artifacts
+
+
+class QueueFull(Exception):
+	pass
+
+
+
+class JobTooLarge(Exception):
+	pass
+
+
+
+_pool = None
+_broken = False
+_lock = threading.Lock()
+
+def pool():
+	""" Returns the pool of worker processes, started on first use and started again if one of its workers died (e.g. killed for lack of memory), along with any job left queued in the database. """
+	global _pool, _broken
+	from midsin.web.models import BatchJob
+	with _lock:
+		if _pool is None or _broken:
+			if _pool is not None:
+				_pool.shutdown(wait=False, cancel_futures=True)
+			_pool = concurrent.futures.ProcessPoolExecutor(settings.MIDSIN_JOB_WORKERS, initializer=_init_worker)
+			_broken = False
+			# Jobs still queued at exit are submitted again on restart
+			atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+			for jobid in BatchJob.objects.filter(status='queued').values_list('id', flat=True):
+				_pool.submit(run, str(jobid)).add_done_callback(_check)
+	return _pool
+
+
+
+def _check(future):
+	# Flags the pool as broken once one of its jobs failed because of it
+	global _broken
+	if not future.cancelled() and isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+		_broken = True
+
+
+
+def _submit(jobid):
+	# Submits job jobid to the pool, started again if it turns out broken
+	global _broken
+	try:
+		future = pool().submit(run, jobid)
+	except concurrent.futures.process.BrokenProcessPool:
+		_broken = True
+		future = pool().submit(run, jobid)
+	future.add_done_callback(_check)
+
+
+
+def recover():
+	""" Fails the jobs left running past their time limit (interrupted by a restart of the server or the death of their worker), and starts the pool, if needed, to run the jobs left queued. """
+	from midsin.web.models import BatchJob
+	stale = timezone.now() - datetime.timedelta(seconds=settings.MIDSIN_JOB_TIMEOUT)
+	BatchJob.objects.filter(status='running', started__lt=stale).update(status='failed', finished=timezone.now(), message='Interrupted.')
+	pool()
+
+
+
+def _init_worker():
+	import django
+	from django.apps import apps
+	from django.db import connections
+	# Spawned (rather than forked) workers must set up django themselves
+	if not apps.ready:
+		django.setup()
+	# Forked workers must not share the server's database connections
+	connections.close_all()
+	midsin.cache.configure(settings.MIDSIN_CACHE_SIZE, settings.MIDSIN_CACHE_PATH, settings.MIDSIN_CACHE_DISK_SIZE)
+	midsin.plot.usetex = settings.MIDSIN_USETEX
+
+
+
+def _isdata(line):
+	return line and (midsin.label['Vinoc'] not in line) and (line[0] != '#')
+
+
+
+def submit(text):
+	"""Queues the analysis of an uploaded csv file.
+
+	Args:
+		text: The content of the csv file.
+
+	Returns:
+		job: The midsin.web.models.BatchJob created.
+
+	Raises:
+		JobTooLarge: If the file exceeds the per-job limits.
+		QueueFull: If MIDSIN_JOB_QUEUE_DEPTH jobs are already queued or running.
+
+	"""
+	from midsin.web.models import BatchJob
+	recover()
+	if len(text) > settings.MIDSIN_JOB_MAX_BYTES:
+		raise JobTooLarge('The file exceeds %d bytes.' % settings.MIDSIN_JOB_MAX_BYTES)
+	nlines = sum(1 for line in _reader(text) if _isdata(line))
+	if nlines > settings.MIDSIN_JOB_MAX_LINES:
+		raise JobTooLarge('The file has %d sample outcomes, more than the %d allowed.' % (nlines, settings.MIDSIN_JOB_MAX_LINES))
+	if BatchJob.objects.filter(status__in=('queued','running')).count() >= settings.MIDSIN_JOB_QUEUE_DEPTH:
+		raise QueueFull('The server is busy, please try again in a few minutes.')
+	job = BatchJob.objects.create(input=text, nlines=nlines)
+	_submit(str(job.id))
+	return job
+
+
+
+def _reader(text):
+	return csv.reader(io.StringIO(text),delimiter=',',quotechar="|")
+
+
+
+def _csvline(fields):
+	f = io.StringIO()
+	csv.writer(f,delimiter=',',lineterminator='').writerow(fields)
+	return f.getvalue()
+
+
+
+def run(jobid):
+	""" Analyses the queued job jobid, unless another worker already claimed it, saving each sample outcome's BatchAssay as it is done, then renders its result files, all within MIDSIN_JOB_TIMEOUT. """
+	from midsin.web.models import BatchAssay, BatchJob
+	if not BatchJob.objects.filter(id=jobid, status='queued').update(status='running', started=timezone.now()):
+		return
+	job = BatchJob.objects.get(id=jobid)
+	fields = {}
+	try:
+		deadline = time.monotonic() + settings.MIDSIN_JOB_TIMEOUT
+		reported = time.monotonic()
+		writer_file = io.StringIO()
+		writer = csv.writer(writer_file,delimiter=',')
+		errors = []
+		labels = []
+		assays = []
+		done = []
+		iline = 0
+		# the assays are kept without their grids until their page is rendered
+		for line, idassay in midsin.utils.iter_output(_reader(job.input), errors=errors, keep_grid=False):
+			writer.writerow(line)
+			iline += 1
+			if _isdata(line):
+				# line is the input line with the outcols (or error) appended
+				if idassay is None:
+					done.append( BatchAssay(job=job, iline=iline, label=line[0], line=_csvline(line[:-1]), error=str(errors[-1][1])) )
+				else:
+					results = ' '.join(repr(float(a)) for a in line[-len(midsin.outcols):])
+					done.append( BatchAssay(job=job, iline=iline, label=line[0], line=_csvline(line[:-len(midsin.outcols)]), results=results) )
+			# save the sample outcomes done at most once per second
+			if time.monotonic() > reported + 1.0:
+				_save(job, done)
+				reported = time.monotonic()
+			if idassay is not None:
+				labels.append( line[0] )
+				assays.append( idassay )
+			_check_deadline(deadline)
+		_save(job, done)
+		# zip of [graphs as pdf] + [results as csv]
+		image_file = io.BytesIO()
+		midsin.utils.render_pages(_until(deadline, zip(assays,labels)), image_file)
+		zipbuffer = io.BytesIO()
+		with zipfile.ZipFile(zipbuffer,'w') as zf:
+			_writestr(zf,'output.pdf',image_file.getvalue())
+			_writestr(zf,'output.csv',writer_file.getvalue())
+		fields.update(csv=writer_file.getvalue(), zipid=midsin.web.artifacts.put(zipbuffer.getvalue()), status='done')
+	except Exception as e:
+		fields.update(status='failed', message=str(e))
+	# unless recover() already failed the job as interrupted
+	BatchJob.objects.filter(id=job.id, status='running').update(finished=timezone.now(), **fields)
+
+
+
+def _writestr(zf, name, data):
+	# Writes a file with a fixed timestamp into the zip, such that the same
+	# results give the same artifact (see midsin.web.artifacts.put)
+	info = zipfile.ZipInfo(name, date_time=(1980,1,1,0,0,0))
+	info.external_attr = 0o644 << 16
+	zf.writestr(info, data)
+
+
+
+def _check_deadline(deadline):
+	if time.monotonic() > deadline:
+		raise TimeoutError('The job exceeded its %g s time limit.' % settings.MIDSIN_JOB_TIMEOUT)
+
+
+
+def _until(deadline, items):
+	# Yields the items, as long as the job is within its time limit
+	for item in items:
+		_check_deadline(deadline)
+		yield item
+
+
+
+def _save(job, done):
+	from midsin.web.models import BatchAssay, BatchJob
+	BatchAssay.objects.bulk_create(done)
+	job.ndone += len(done)
+	BatchJob.objects.filter(id=job.id).update(ndone=job.ndone)
+	done.clear()
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:25
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=8)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('input', models.TextField()),
+                ('nlines', models.IntegerField(default=0)),
+                ('ndone', models.IntegerField(default=0)),
+                ('csv', models.TextField(blank=True)),
+                ('svg', models.TextField(blank=True)),
+                ('zip', models.BinaryField(blank=True, null=True)),
+                ('errors', models.TextField(blank=True)),
+                ('message', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['created'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='batchjob',
+            name='zip',
+        ),
+        migrations.AddField(
+            model_name='batchjob',
+            name='zipid',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
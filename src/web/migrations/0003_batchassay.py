@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0002_batchjob_zipid'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='batchjob',
+            name='errors',
+        ),
+        migrations.RemoveField(
+            model_name='batchjob',
+            name='svg',
+        ),
+        migrations.CreateModel(
+            name='BatchAssay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iline', models.IntegerField()),
+                ('label', models.TextField(blank=True)),
+                ('line', models.TextField()),
+                ('results', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assays', to='web.batchjob')),
+            ],
+            options={
+                'ordering': ['job', 'iline'],
+                'unique_together': {('job', 'iline')},
+            },
+        ),
+    ]
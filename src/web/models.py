@@ -0,0 +1,84 @@
+# Copyright (C) 2020-2022 Catherine Beauchemin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+import csv
+import uuid
+from django.db import models
+import midsin
+import midsin.utils
+
+
+
+class BatchJob(models.Model):
+	""" A batch of sample outcomes (uploaded csv file) analysed in the background by midsin.web.jobs. """
+	STATUSES = [
+		('queued', 'Queued'),
+		('running', 'Running'),
+		('done', 'Done'),
+		('failed', 'Failed'),
+	]
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	status = models.CharField(max_length=8, choices=STATUSES, default='queued')
+	created = models.DateTimeField(auto_now_add=True)
+	started = models.DateTimeField(null=True, blank=True)
+	finished = models.DateTimeField(null=True, blank=True)
+	# The uploaded csv file and its # of sample outcomes (analysed so far)
+	input = models.TextField()
+	nlines = models.IntegerField(default=0)
+	ndone = models.IntegerField(default=0)
+	# The results, along with the BatchAssay of each sample outcome: output
+	# csv file and ID of the zip of [pdf] + [csv] in the store of result
+	# files (see midsin.web.artifacts)
+	csv = models.TextField(blank=True)
+	zipid = models.CharField(max_length=64, blank=True)
+	# Why the job failed, if it did
+	message = models.TextField(blank=True)
+
+	class Meta:
+		ordering = ['created']
+
+	def __str__(self):
+		return '%s (%s)' % (self.id, self.status)
+
+
+
+class BatchAssay(models.Model):
+	""" The analysis of one sample outcome (csv line) of a BatchJob, saved as soon as it is done. """
+	job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='assays')
+	# Line # in the csv file, its label and the input columns of the line
+	iline = models.IntegerField()
+	label = models.TextField(blank=True)
+	line = models.TextField()
+	# The midsin.outcols (space-separated), or why the line could not be
+	# analysed
+	results = models.TextField(blank=True)
+	error = models.TextField(blank=True)
+
+	class Meta:
+		ordering = ['job', 'iline']
+		unique_together = [('job', 'iline')]
+
+	def __str__(self):
+		return '%s line %d' % (self.job_id, self.iline)
+
+	def values(self):
+		""" Returns the list of the midsin.outcols values. """
+		return [float(a) for a in self.results.split()]
+
+	def assay(self):
+		""" Returns the midsin.Assay of the line (computed again, or from midsin.cache). """
+		return midsin.Assay(*midsin.utils.parse_line(next(csv.reader([self.line]))))
@@ -15,6 +15,7 @@ import os
 # Application definition
 
 INSTALLED_APPS = [
+	'midsin.web',
 	'django.contrib.auth',
 	'django.contrib.contenttypes',
 	'django.contrib.sessions',
@@ -60,9 +61,51 @@ DATABASES = {
 	'default': {
 		'ENGINE': 'django.db.backends.sqlite3',
 		'NAME': os.path.join(os.environ["MIDSIN_WEB_PATH"], 'db.sqlite3'),
+		# batch jobs are written by several worker processes
+		'OPTIONS': {'timeout': 30},
 	}
 }
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# midSIN result cache (see midsin.cache), which can be shared with the
+# midsin command-line tool by pointing both to the same sqlite file
+
+MIDSIN_CACHE_SIZE = int(os.environ.get('MIDSIN_CACHE_SIZE', 256))
+MIDSIN_CACHE_PATH = os.environ.get('MIDSIN_CACHE_PATH')
+MIDSIN_CACHE_DISK_SIZE = int(os.environ.get('MIDSIN_CACHE_DISK_SIZE', 100000))
+
+# Typeset the graphs with LaTeX (requires a TeX install) rather than with
+# matplotlib's much faster mathtext (see midsin.plot.usetex)
+
+MIDSIN_USETEX = os.environ.get('MIDSIN_USETEX', '0').lower() in ('1', 'true', 'yes')
+
+# Batch jobs (see midsin.web.jobs): # of worker processes, # of jobs queued
+# or running beyond which new ones are refused, and per-job limits on the
+# size (bytes) and # of sample outcomes of the csv file, and the time (s)
+# taken to analyse it
+
+MIDSIN_JOB_WORKERS = int(os.environ.get('MIDSIN_JOB_WORKERS', 2))
+MIDSIN_JOB_QUEUE_DEPTH = int(os.environ.get('MIDSIN_JOB_QUEUE_DEPTH', 32))
+MIDSIN_JOB_MAX_BYTES = int(os.environ.get('MIDSIN_JOB_MAX_BYTES', 2*1024*1024))
+MIDSIN_JOB_MAX_LINES = int(os.environ.get('MIDSIN_JOB_MAX_LINES', 2000))
+MIDSIN_JOB_TIMEOUT = float(os.environ.get('MIDSIN_JOB_TIMEOUT', 600))
+
+# Store of result files (see midsin.web.artifacts): directory, time (s)
+# they are kept and largest total size (bytes) before the oldest are evicted
+
+MIDSIN_ARTIFACT_PATH = os.environ.get('MIDSIN_ARTIFACT_PATH', os.path.join(os.environ["MIDSIN_WEB_PATH"], 'artifacts'))
+MIDSIN_ARTIFACT_TTL = float(os.environ.get('MIDSIN_ARTIFACT_TTL', 7*24*3600))
+MIDSIN_ARTIFACT_MAX_BYTES = int(os.environ.get('MIDSIN_ARTIFACT_MAX_BYTES', 1024**3))
+
+# JSON API (api/assays): largest request size (bytes) and # of assays, and
+# # of assays analysed at once before their results are sent back
+
+MIDSIN_API_MAX_BYTES = int(os.environ.get('MIDSIN_API_MAX_BYTES', 16*1024*1024))
+MIDSIN_API_MAX_ASSAYS = int(os.environ.get('MIDSIN_API_MAX_ASSAYS', 100000))
+MIDSIN_API_CHUNK = int(os.environ.get('MIDSIN_API_CHUNK', 64))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -13,7 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.urls import path
+from django.urls import path, re_path
 import midsin.web.views
 
 urlpatterns = [
@@ -21,5 +21,9 @@ urlpatterns = [
     path('onesample', midsin.web.views.onesample, name="onesample"),
     path('batch', midsin.web.views.batch, name="batch"),
     path('csv_template', midsin.web.views.csv_template, name="csv_template"),
-    path('download_batchres', midsin.web.views.download_batchres, name="download_batchres"),
+    path('batch/<uuid:jobid>', midsin.web.views.batch_job, name="batch_job"),
+    path('batch/<uuid:jobid>/<int:iline>/<str:panel>.svg', midsin.web.views.batch_plot, name="batch_plot"),
+    path('batch/<uuid:jobid>/status', midsin.web.views.batch_status, name="batch_status"),
+    path('api/assays', midsin.web.views.api_assays, name="api_assays"),
+    re_path(r'^results/(?P<artid>[0-9a-f]{64})$', midsin.web.views.download_batchres, name="download_batchres"),
 ]
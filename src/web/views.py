@@ -16,14 +16,30 @@
 #
 # =============================================================================
 
-from django.shortcuts import render
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib import messages
+from django.core.paginator import Paginator
+from django.shortcuts import get_object_or_404, redirect, render
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from midsin.web.models import BatchAssay, BatchJob
 import midsin.web.forms as sinforms
+import midsin.web.artifacts
+import midsin.web.jobs
+import midsin.cache
+import midsin.plot
 import midsin.utils
 import io
 import csv
-import zipfile
+import itertools
+import json
+import numpy
+import os
+import re
 
+midsin.cache.configure(settings.MIDSIN_CACHE_SIZE, settings.MIDSIN_CACHE_PATH, settings.MIDSIN_CACHE_DISK_SIZE)
+midsin.plot.usetex = settings.MIDSIN_USETEX
 
 
 def home(request):
@@ -73,7 +89,7 @@ def onesample(request):
 		gridfig,csvout = midsin.utils.dict_to_output(data)
 		# Save figure file
 		figfile = io.StringIO()
-		gridfig.fig.savefig(figfile,format='svg',bbox_inches='tight')
+		gridfig.savefig(figfile,format='svg',bbox_inches='tight')
 		return render(request,"templates/onesample.html",{'status':'results', 'params':data, 'image':figfile.getvalue(), 'template':csvout.getvalue()})
 
 
@@ -82,32 +98,210 @@ def batch(request):
 	if request.method == "GET":
 		return render(request, "templates/batch.html")
 
-	# POST method, i.e. user sends input csv file to server
-
-	# prepare input csv file to read
-	lines = request.FILES['file'].read().decode('UTF-8')
-	lines = csv.reader(io.StringIO(lines),delimiter=',',quotechar="|")
-	# compute results using midsin
-	gridfig, writer_file = midsin.utils.csv_to_output(lines)
-	# save graph for web display
-	figtext = io.StringIO()
-	gridfig.fig.savefig(figtext,format='svg',bbox_inches='tight')
-	# Pack-up zip of [image as pdf] + [results as csv]
-	image_file = io.BytesIO()
-	gridfig.fig.savefig(image_file,format='pdf',bbox_inches='tight')
-	zipbuffer = io.BytesIO()
-	with zipfile.ZipFile(zipbuffer,'w') as zf:
-		zf.writestr('output.pdf',image_file.getvalue())
-		zf.writestr('output.csv',writer_file.getvalue())
-	# return figfile and writerfile
-	return render(request,'templates/batch.html',{'image':figtext.getvalue(), 'writer_file':writer_file.getvalue(),'zipbuffer':zipbuffer.getvalue().hex()})
-
-
-
-def download_batchres(request):
-	# grab the file via the request
-	zipbuffer = bytes.fromhex(request.POST.get('zipbuffer'))
+	# POST method, i.e. user sends input csv file to server, whose analysis
+	# is queued (see midsin.web.jobs) while the user is sent to its page
+	upload = request.FILES.get('file')
+	if upload is None:
+		messages.error(request, 'Please select a csv file to upload.')
+		return render(request, "templates/batch.html", status=400)
+	if upload.size > settings.MIDSIN_JOB_MAX_BYTES:
+		messages.error(request, 'The file exceeds %d bytes.' % settings.MIDSIN_JOB_MAX_BYTES)
+		return render(request, "templates/batch.html", status=413)
+	try:
+		job = midsin.web.jobs.submit(upload.read().decode('UTF-8'))
+	except midsin.web.jobs.JobTooLarge as e:
+		messages.error(request, str(e))
+		return render(request, "templates/batch.html", status=413)
+	except midsin.web.jobs.QueueFull as e:
+		messages.error(request, str(e))
+		return render(request, "templates/batch.html", status=503)
+	return redirect('batch_job', jobid=job.id)
+
+
+
+def batch_job(request, jobid):
+	job = get_object_or_404(BatchJob, id=jobid)
+	# The sample outcomes done so far, a page at a time
+	page = Paginator(job.assays.all(), 25).get_page(request.GET.get('page'))
+	return render(request, 'templates/batch.html', {'job':job, 'page':page, 'label':midsin.label['name'], 'outcols':[midsin.label[key] for key in midsin.outcols]})
+
+
+
+def _plot_etag(request, jobid, iline, panel):
+	# The plot only changes with midsin's results or typesetting
+	if not BatchAssay.objects.filter(job_id=jobid, iline=iline, error='').exists():
+		return None
+	return '%s-%d-%s-%d%d' % (jobid, iline, panel, midsin.cache.VERSION, midsin.plot.usetex)
+
+
+
+@condition(etag_func=_plot_etag)
+def batch_plot(request, jobid, iline, panel):
+	""" Renders the plot of one sample outcome of a batch job on demand, as svg. """
+	row = get_object_or_404(BatchAssay, job_id=jobid, iline=iline, error='')
+	if panel not in ('lC_post', 'observed_wells'):
+		raise Http404()
+	figfile = io.StringIO()
+	midsin.plot.assay_panel(row.assay(), panel).savefig(figfile,format='svg',bbox_inches='tight')
+	response = HttpResponse(figfile.getvalue(), content_type='image/svg+xml')
+	response['Cache-Control'] = 'private, max-age=%d' % settings.MIDSIN_ARTIFACT_TTL
+	return response
+
+
+
+def batch_status(request, jobid):
+	job = get_object_or_404(BatchJob, id=jobid)
+	if job.status in ('queued','running'):
+		midsin.web.jobs.recover()
+		job.refresh_from_db()
+	return JsonResponse({'status':job.status, 'nlines':job.nlines, 'ndone':job.ndone, 'message':job.message})
+
+
+
+def _artifact_etag(request, artid):
+	return artid if midsin.web.artifacts.path(artid) else None
+
+
+
+@condition(etag_func=_artifact_etag)
+def download_batchres(request, artid):
+	""" Serves the result file artid from the store (see midsin.web.artifacts), or the single byte range requested, so that downloads can be resumed. """
+	path = midsin.web.artifacts.path(artid)
+	if path is None:
+		raise Http404('These results have expired.')
+	size = os.path.getsize(path)
+	f = open(path, 'rb')
+	# Only honour the Range if the client still has the same content
+	match = re.fullmatch(r'bytes=(\d*)-(\d*)', request.headers.get('Range', ''))
+	if match and request.headers.get('If-Range', '"%s"'%artid) == '"%s"'%artid and match.group(0) != 'bytes=-':
+		first, last = match.groups()
+		if first:
+			first, last = int(first), min(int(last or size-1), size-1)
+		else:
+			first, last = max(size-int(last), 0), size-1
+		if first > last:
+			f.close()
+			response = HttpResponse(status=416)
+			response['Content-Range'] = 'bytes */%d' % size
+			return response
+		f.seek(first)
+		response = StreamingHttpResponse(_read_range(f, last-first+1), status=206, content_type="application/x-zip-compressed")
+		response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+		response['Content-Length'] = last-first+1
+	else:
+		response = FileResponse(f, content_type="application/x-zip-compressed")
 	#return zip-file as attachment
-	response = HttpResponse(zipbuffer, content_type="application/x-zip-compressed")
 	response['Content-Disposition'] = 'attachment; filename=output.zip'
+	response['Accept-Ranges'] = 'bytes'
+	response['Cache-Control'] = 'private, max-age=%d, immutable' % settings.MIDSIN_ARTIFACT_TTL
 	return response
+
+
+
+def _read_range(f, nbytes, blocksize=65536):
+	with f:
+		while nbytes > 0:
+			block = f.read(min(blocksize, nbytes))
+			if not block:
+				break
+			nbytes -= len(block)
+			yield block
+
+
+
+def _api_items(request):
+	# Yields the assays of a JSON array or JSON-lines request body, read
+	# lazily (JSON lines) so that results can be sent back before the whole
+	# body is received, up to MIDSIN_API_MAX_BYTES. A line which is not
+	# valid JSON is yielded as the error it raised, and the body ends with
+	# the error of exceeding MIDSIN_API_MAX_BYTES, if it does
+	nbytes = 0
+	first = request.read(1)
+	while first.isspace():
+		first = request.read(1)
+	if first == b'[':
+		body = first + request.read(settings.MIDSIN_API_MAX_BYTES)
+		if len(body) > settings.MIDSIN_API_MAX_BYTES:
+			yield ValueError('The request exceeds %d bytes.' % settings.MIDSIN_API_MAX_BYTES)
+			return
+		try:
+			items = json.loads(body)
+		except ValueError as e:
+			yield ValueError('Invalid JSON: %s' % e)
+			return
+		yield from items
+		return
+	for line in itertools.chain([first + request.readline()], request):
+		nbytes += len(line)
+		if nbytes > settings.MIDSIN_API_MAX_BYTES:
+			yield ValueError('The request exceeds %d bytes.' % settings.MIDSIN_API_MAX_BYTES)
+			return
+		if line.strip():
+			try:
+				yield json.loads(line)
+			except ValueError as e:
+				yield ValueError('Invalid JSON: %s' % e)
+
+
+
+def _api_inputs(item):
+	# Returns the midsin.Assay arguments of one assay of the request
+	if isinstance(item, Exception):
+		raise item
+	if not isinstance(item, dict):
+		raise ValueError('Each assay must be an object with fields %s.' % ', '.join(midsin.incols))
+	Vinoc, dilmin, dilfac = (float(item[key]) for key in ('Vinoc','dilmin','dilfac'))
+	ntot, ninf = ([int(a) for a in item[key]] for key in ('ntot','ninf'))
+	assert len(ntot) == len(ninf) > 0, "Length of ninf != ntot."
+	assert 0 < Vinoc and 0 < dilmin <= 1 and 0 < dilfac < 1, "Vinoc, dilmin and dilfac must be > 0, dilmin <= 1 and dilfac < 1."
+	assert all(0 <= k <= n for k,n in zip(ninf,ntot)), "Must have 0 <= ninf <= ntot."
+	assert sum(ntot) > 0, "Must have ntot > 0 for at least one dilution."
+	assert max(ntot) <= midsin.maxwells, "Must have ntot <= %d." % midsin.maxwells
+	return Vinoc, dilmin, dilfac, ninf, ntot
+
+
+
+def _api_results(items, precision):
+	# Yields the JSON line of the results (or error) of each assay, a chunk
+	# of MIDSIN_API_CHUNK assays being analysed at once by midsin.AssayBatch.
+	# The assays beyond MIDSIN_API_MAX_ASSAYS are replaced by one error
+	index = 0
+	items = iter(items)
+	for chunk in iter(lambda: list(itertools.islice(items, settings.MIDSIN_API_CHUNK)), []):
+		excess = index + len(chunk) > settings.MIDSIN_API_MAX_ASSAYS
+		chunk = chunk[:settings.MIDSIN_API_MAX_ASSAYS-index]
+		results = [{'index':index+i} for i in range(len(chunk))]
+		inputs = []
+		for res, item in zip(results, chunk):
+			try:
+				res['name'] = item.get('name') if isinstance(item, dict) else None
+				inputs.append( (res, _api_inputs(item)) )
+			except KeyError as e:
+				res['error'] = 'Missing field %s.' % e
+			except Exception as e:
+				res['error'] = str(e) or repr(e)
+		if inputs:
+			batch = midsin.AssayBatch(*zip(*[args for res,args in inputs]), precision=precision)
+			for i, (res, args) in enumerate(inputs):
+				for key in midsin.outcols:
+					value = float(batch.pack[key][i])
+					res[key] = value if numpy.isfinite(value) else None
+		for res in results:
+			yield json.dumps(res) + '\n'
+		index += len(chunk)
+		if excess:
+			yield json.dumps({'index':index, 'error':'The request exceeds %d assays.' % settings.MIDSIN_API_MAX_ASSAYS}) + '\n'
+			return
+
+
+
+@csrf_exempt
+@require_POST
+def api_assays(request):
+	""" Analyses the assays (objects with the midsin.incols fields) of a JSON array or JSON-lines body, and streams back one JSON line of results (the midsin.outcols, null at the limit of detection) or error per assay, without any plot. """
+	precision = request.GET.get('precision', 'standard')
+	if precision not in midsin.precisions:
+		return JsonResponse({'error':'precision must be one of %s.' % ', '.join(midsin.precisions)}, status=400)
+	if int(request.headers.get('Content-Length') or 0) > settings.MIDSIN_API_MAX_BYTES:
+		return JsonResponse({'error':'The request exceeds %d bytes.' % settings.MIDSIN_API_MAX_BYTES}, status=413)
+	return StreamingHttpResponse(_api_results(_api_items(request), precision), content_type='application/x-ndjson')